@@ -31,26 +31,37 @@ Changelog:
           - Integrado en funciones move, restore, delete
 """
 
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, Response, render_template, jsonify, request, send_file, stream_with_context
+from werkzeug.http import parse_date, parse_etags
+from werkzeug.wsgi import wrap_file
 from PIL import Image, ImageOps
 import os
-import hashlib
+import functools
 import io
 import json
+import math
 from pathlib import Path
+import secrets
 import threading
+import catalog
+import decode_limit
+import decoder
+import jobs
+import render_cache
+import streaming
+import tiles
+from decode_limit import DecoderBusy
+from raw_reader import read_raw_exif, read_embedded_preview, read_raw_dimensions
 from config import load_config, save_config, is_path_allowed
+from media import (RAW_EXTENSIONS, JPG_EXTENSIONS, VIDEO_EXTENSIONS, EXIF_FIELDS, list_media,
+                   apply_exif, find_stale_sources, catalog_entry, iter_extract, extract_all,
+                   file_version)
 
 app = Flask(__name__)
 
 # Debug mode for EXIF extraction (set to True to see all EXIF tags in console)
 EXIF_DEBUG = os.environ.get('EXIF_DEBUG', 'False').lower() == 'true'
 
-# RAW file extensions
-RAW_EXTENSIONS = {'.cr2', '.cr3', '.arw', '.nef', '.pef', '.dng', '.raf', '.orf'}
-JPG_EXTENSIONS = {'.jpg', '.jpeg'}
-VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.avi', '.m4v'}
-
 # System folders to exclude from browsing
 EXCLUDED_FOLDERS = {
     # Windows
@@ -67,11 +78,42 @@ EXCLUDED_FOLDERS = {
 
 # Cache for thumbnails
 THUMBNAIL_DIR = 'static/thumbnails'
-THUMBNAIL_SIZE = (300, 300)
+# Thumbnail tiers (longest edge in px), all rendered from a single decode
+THUMBNAIL_TIERS = (160, 320, 640)
+DEFAULT_THUMBNAIL_TIER = 320
+# Thumbnail encodings: name -> (mimetype, suffix, save options)
+THUMBNAIL_FORMATS = {
+    'jpeg': ('image/jpeg', '.jpg', {'format': 'JPEG', 'quality': 78, 'optimize': True}),
+    'webp': ('image/webp', '.webp', {'format': 'WEBP', 'quality': 75, 'method': 4}),
+    'avif': ('image/avif', '.avif', {'format': 'AVIF', 'quality': 55, 'speed': 8}),
+}
+# Cross-worker generation locks (see render_cache.single_flight)
+LOCK_DIR = os.path.join(THUMBNAIL_DIR, '.locks')
+# Long edges (px) resized display copies are rendered at; requests round up to one
+DISPLAY_SIZES = (1280, 1920, 2560, 3840, 5120)
+# URLs carrying the file version (&v=, from /api/scan) never change content
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Bytes read per step when a video is not sent with sendfile()
+VIDEO_CHUNK_BYTES = 256 * 1024
+# Seconds a client over its stream limit is asked to wait
+VIDEO_RETRY_AFTER = 2
+# A video stream whose client reads nothing for this long is closed (a paused
+# player reconnects with a Range when resumed)
+VIDEO_STALL_SECONDS = 60
+# Seconds before render_cache.LOCK_TIMEOUT a web worker stops waiting for the decode service
+DECODER_LOCK_MARGIN = 10
+# Video extension -> mimetype
+VIDEO_MIMETYPES = {
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+    '.mkv': 'video/x-matroska',
+    '.avi': 'video/x-msvideo',
+    '.m4v': 'video/mp4'
+}
 
 def get_file_hash(filepath):
-    """Generate hash for file path to use as thumbnail name"""
-    return hashlib.md5(filepath.encode()).hexdigest()
+    """Content-versioned thumbnail name (size, mtime and file head; see render_cache)"""
+    return render_cache.cache_key(filepath, load_config()['catalog_path'])
 
 def is_raw_file(filename):
     """Check if file is a RAW format"""
@@ -88,31 +130,6 @@ def is_video_file(filename):
     ext = os.path.splitext(filename)[1].lower()
     return ext in VIDEO_EXTENSIONS
 
-def find_paired_raw(jpg_path):
-    """Find corresponding RAW file for a JPG"""
-    base_name = os.path.splitext(jpg_path)[0]
-    directory = os.path.dirname(jpg_path)
-
-    for ext in RAW_EXTENSIONS:
-        # Check both lowercase and uppercase extensions
-        for raw_ext in [ext, ext.upper()]:
-            raw_path = base_name + raw_ext
-            if os.path.exists(raw_path):
-                return raw_path
-    return None
-
-def find_paired_jpg(raw_path):
-    """Find corresponding JPG file for a RAW"""
-    base_name = os.path.splitext(raw_path)[0]
-
-    for ext in JPG_EXTENSIONS:
-        # Check both lowercase and uppercase extensions
-        for jpg_ext in [ext, ext.upper()]:
-            jpg_path = base_name + jpg_ext
-            if os.path.exists(jpg_path):
-                return jpg_path
-    return None
-
 def should_exclude_folder(folder_name):
     """Check if folder should be excluded from browsing"""
     folder_lower = folder_name.lower()
@@ -143,7 +160,8 @@ def get_camera_brand(filename):
     return brand_map.get(ext, '')
 
 def extract_exif_data(image_path, debug=False):
-    """Extract EXIF data from image file using rawpy for RAW and exifread for JPG
+    """Extract EXIF data from image file using the RAW header reader (rawpy as
+    fallback) for RAW and exifread for JPG
 
     Returns dict with: camera_brand, camera_model, iso, aperture, shutter_speed, date
 
@@ -165,9 +183,20 @@ def extract_exif_data(image_path, debug=False):
     is_raw = ext in RAW_EXTENSIONS
     is_jpg = ext in JPG_EXTENSIONS
 
+    # Fast path for RAW: parse the TIFF/EXIF header without opening the decoder
+    if is_raw:
+        header_exif = read_raw_exif(image_path)
+        if header_exif:
+            if debug:
+                print(f"\n=== EXIF DEBUG (header) for: {os.path.basename(image_path)} ===")
+                for key, value in header_exif.items():
+                    print(f"  {key}: {value}")
+                print("=" * 60)
+            return header_exif
+
     try:
         if is_raw:
-            # Use rawpy for RAW files
+            # Fall back to rawpy when the header could not be parsed
             import rawpy
 
             with rawpy.imread(image_path) as raw:
@@ -278,90 +307,610 @@ def extract_exif_data(image_path, debug=False):
 
     return exif_data
 
-def generate_video_thumbnail(video_path):
-    """Generate thumbnail from first frame of video"""
-    try:
-        import cv2
+def track_cache_file(file_path, file_hash):
+    """Register a new cache file so the cache stays within its byte budget"""
+    config = load_config()
+    render_cache.record_entry(config['catalog_path'], THUMBNAIL_DIR, file_path, file_hash,
+                              config['thumbnail_cache_max_mb'] * 1024 * 1024,
+                              config['thumbnail_cache_policy'])
+
+def thumbnail_tier(size):
+    """Smallest tier covering a requested size (the largest tier if none does)"""
+    for tier in THUMBNAIL_TIERS:
+        if tier >= size:
+            return tier
+    return THUMBNAIL_TIERS[-1]
+
+def thumbnail_formats():
+    """Encodings enabled in the config that this Pillow can write; JPEG always"""
+    Image.init()
+    formats = [fmt for fmt in load_config()['thumbnail_formats']
+               if fmt in THUMBNAIL_FORMATS and THUMBNAIL_FORMATS[fmt][2]['format'] in Image.SAVE]
+    if 'jpeg' not in formats:
+        formats.append('jpeg')
+    return formats
+
+def negotiate_thumbnail_format():
+    """First enabled encoding the client names explicitly in Accept
+
+    Wildcards do not count: every browser sends */*, but only the ones that
+    decode WebP/AVIF list them.
+    """
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    for fmt in thumbnail_formats():
+        if THUMBNAIL_FORMATS[fmt][0] in accepted:
+            return fmt
+    return 'jpeg'
 
+def thumbnail_paths(file_hash, formats, profile=''):
+    """Cache file of every tier and encoding: <key>_<tier><profile>.<ext>
+
+    RAWs carry their render profile, so changing raw_render_profile renders
+    new thumbnails instead of serving the old ones.
+    """
+    return {(tier, fmt): render_cache.cache_path(THUMBNAIL_DIR, file_hash,
+                                                 f'_{tier}{profile}{THUMBNAIL_FORMATS[fmt][1]}')
+            for tier in THUMBNAIL_TIERS for fmt in formats}
+
+def missing_variants(paths):
+    """(tier, format) pairs not rendered yet"""
+    catalog_path = load_config()['catalog_path']
+    return [variant for variant, path in paths.items()
+            if not render_cache.find_cached(catalog_path, THUMBNAIL_DIR, path)]
+
+def save_thumbnail_tiers(img, file_hash, paths, variants):
+    """Downscale one decoded image through the missing tiers, largest first,
+    encoding each tier in every missing format"""
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    for tier in sorted({tier for tier, _ in variants}, reverse=True):
+        img.thumbnail((tier, tier), Image.Resampling.LANCZOS)
+        for fmt in (fmt for variant_tier, fmt in variants if variant_tier == tier):
+            # Write-then-rename, never a torn file
+            render_cache.save_image(img, paths[tier, fmt], **THUMBNAIL_FORMATS[fmt][2])
+            track_cache_file(paths[tier, fmt], file_hash)
+
+def generate_video_thumbnail(video_path, tier=DEFAULT_THUMBNAIL_TIER, fmt='jpeg'):
+    """Generate thumbnail tiers from first frame of video"""
+    try:
         # Check if thumbnail already exists
         file_hash = get_file_hash(video_path)
-        thumbnail_path = os.path.join(THUMBNAIL_DIR, f"{file_hash}.jpg")
-
-        if os.path.exists(thumbnail_path):
-            return thumbnail_path
+        paths = thumbnail_paths(file_hash, dict.fromkeys([fmt, *thumbnail_formats()]))
 
-        # Open video and extract first frame
-        cap = cv2.VideoCapture(video_path)
+        if render_cache.find_cached(load_config()['catalog_path'], THUMBNAIL_DIR, paths[tier, fmt]):
+            return paths[tier, fmt]
 
-        # Try to read the first frame
-        success, frame = cap.read()
-        cap.release()
+        # Only one worker decodes a given file; the others wait for its result
+        with render_cache.single_flight(render_cache.cache_path(THUMBNAIL_DIR, file_hash, '.jpg'), LOCK_DIR):
+            variants = missing_variants(paths)
+            if (tier, fmt) not in variants:
+                return paths[tier, fmt]
 
-        if not success:
-            print(f"Failed to read first frame from {video_path}")
-            return None
+            if not offload('video_thumbnail', video_path, file_hash, paths, variants):
+                return None
+            return paths[tier, fmt]
 
-        # Convert BGR to RGB (OpenCV uses BGR)
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    except DecoderBusy:
+        raise
+    except Exception as e:
+        print(f"Error generating video thumbnail for {video_path}: {e}")
+        return None
 
-        # Convert to PIL Image
-        img = Image.fromarray(frame_rgb)
+def render_video_thumbnail(video_path, file_hash, paths, variants):
+    """Decode a video's first frame and save the missing thumbnail variants"""
+    import cv2
+
+    # Open video and extract first frame
+    cap = cv2.VideoCapture(video_path)
+
+    # Try to read the first frame
+    success, frame = cap.read()
+    cap.release()
+
+    if not success:
+        print(f"Failed to read first frame from {video_path}")
+        return False
+
+    # Convert BGR to RGB (OpenCV uses BGR)
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    # Convert to PIL Image
+    img = Image.fromarray(frame_rgb)
+
+    # Apply EXIF orientation if present
+    img = ImageOps.exif_transpose(img) if img else img
+
+    # Resize maintaining aspect ratio, every missing variant from this frame
+    save_thumbnail_tiers(img, file_hash, paths, variants)
+    return True
+
+# LibRaw flip codes -> EXIF orientation
+RAW_FLIP_ORIENTATION = {0: 1, 3: 3, 5: 8, 6: 6}
+
+def orient_image(img, orientation):
+    """Rotate an image according to an EXIF orientation value"""
+    exif = img.getexif()
+    if orientation and orientation != 1 and not exif.get(0x0112):
+        exif[0x0112] = orientation
+    return ImageOps.exif_transpose(img)
+
+def draft_jpeg(img, box):
+    """Let libjpeg DCT-scale (1/2, 1/4, 1/8) a JPEG while decoding, never below
+    the size the image needs to fill box once oriented"""
+    if img.format != 'JPEG':
+        return img
+    width, height = img.size
+    # Orientations 5-8 rotate 90 degrees, so box applies to the swapped dimensions
+    if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+        box = (box[1], box[0])
+    scale = min(box[0] / width, box[1] / height)
+    if scale < 1:
+        img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+    return img
+
+# rawpy postprocess() settings per RAW render profile: 'quick' (half-size
+# LINEAR demosaic, 8-bit) for thumbnails and previews, 'full' (AHD at full
+# resolution, the rawpy defaults) when full quality is asked for
+RAW_PROFILES = {
+    'quick': {'half_size': True, 'demosaic_algorithm': 'LINEAR', 'output_bps': 8},
+    'full': {},
+}
 
-        # Apply EXIF orientation if present
-        img = ImageOps.exif_transpose(img) if img else img
+# Share of the sensor's long edge an embedded preview must reach to stand in
+# for a sensor-resolution render (sensor sizes include a masked border)
+FULL_PREVIEW_COVERAGE = 0.95
+
+def raw_postprocess_params(profile):
+    """postprocess() keyword arguments of a RAW render profile"""
+    import rawpy
+    params = dict(RAW_PROFILES[profile])
+    if 'demosaic_algorithm' in params:
+        params['demosaic_algorithm'] = rawpy.DemosaicAlgorithm[params['demosaic_algorithm']]
+    return params
+
+def raw_profile(requested=None):
+    """Validated RAW render profile: the requested one or the configured default"""
+    if requested in RAW_PROFILES:
+        return requested
+    profile = load_config()['raw_render_profile']
+    return profile if profile in RAW_PROFILES else 'quick'
+
+def raw_sensor_pixels(image_path):
+    """Sensor pixels of a RAW, known before LibRaw opens (and unpacks) it
+
+    From the TIFF header dimensions; CR3 and RAF fall back to the file size,
+    as compressed RAWs hold roughly one byte per pixel.
+    """
+    size = read_raw_dimensions(image_path)
+    if size:
+        return size[0] * size[1]
+    return os.path.getsize(image_path)
 
-        # Resize maintaining aspect ratio
-        img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+def raw_decode_bytes(sensor_pixels, profile):
+    """Rough peak memory of demosaicing a RAW of sensor_pixels with a render profile
 
-        # Save thumbnail
-        img.save(thumbnail_path, 'JPEG', quality=78, optimize=True)
-        return thumbnail_path
+    The 16-bit sensor data, LibRaw's 4 x 16-bit working image and the RGB
+    output, at a quarter of the pixels in half-size mode.
+    """
+    params = RAW_PROFILES[profile]
+    pixels = sensor_pixels // 4 if params.get('half_size') else sensor_pixels
+    output_bytes = params.get('output_bps', 8) // 8
+    return sensor_pixels * 2 + pixels * (8 + 3 * output_bytes)
 
-    except Exception as e:
-        print(f"Error generating video thumbnail for {video_path}: {e}")
-        return None
+def decode_slot(needed_bytes):
+    """Wait for a RAW decode slot shared by every worker (see decode_limit)
 
-def generate_thumbnail(image_path):
-    """Generate thumbnail for image or video"""
+    Background render threads leave one slot free for interactive requests.
+    Raises DecoderBusy after raw_decode_wait seconds.
+    """
+    config = load_config()
+    slots = max(1, config['raw_decode_slots'])
+    return decode_limit.admit(
+        os.path.join(LOCK_DIR, 'decode'), slots, config['raw_decode_memory_mb'] * 1024 * 1024,
+        needed_bytes, config['raw_decode_wait'],
+        reserved_slots=1 if jobs.in_background() and slots > 1 else 0
+    )
+
+def load_raw_preview(image_path, min_size, profile='full'):
+    """Open the cheapest oriented RGB rendition of a RAW that covers min_size px
+
+    Tries the embedded JPEG preview parsed from the file header, then rawpy's
+    thumbnail, and only demosaics the sensor data (with the given render
+    profile) as a last resort. LibRaw is only opened once a decode slot is
+    free. min_size 0 asks for sensor resolution: only a preview about as
+    large as the sensor (many cameras embed one) spares the demosaic.
+    Returns (img, source) with source 'embedded', 'rawpy_thumb' or 'demosaic'.
+    """
+    wanted = min_size
+    if not min_size:
+        # CR3/RAF headers are not parsed for the sensor size; LibRaw reports it below
+        sensor_size = read_raw_dimensions(image_path)
+        wanted = int(max(sensor_size) * FULL_PREVIEW_COVERAGE) if sensor_size else 0
+    preview = read_embedded_preview(image_path, wanted) if wanted else None
+    if preview:
+        jpeg_data, orientation = preview
+        try:
+            img = Image.open(io.BytesIO(jpeg_data))
+            if max(img.size) >= wanted:
+                if min_size:
+                    draft_jpeg(img, (min_size, min_size))
+                return orient_image(img, orientation), 'embedded'
+        except Exception as e:
+            print(f"Error reading embedded preview of {image_path}: {e}")
+
+    import rawpy
+    # imread() already unpacks the 16-bit sensor data, so admission comes first
+    with decode_slot(raw_decode_bytes(raw_sensor_pixels(image_path), profile)), \
+            rawpy.imread(image_path) as raw:
+        orientation = RAW_FLIP_ORIENTATION.get(raw.sizes.flip, 1)
+        if not min_size:
+            wanted = int(max(raw.sizes.width, raw.sizes.height) * FULL_PREVIEW_COVERAGE)
+        try:
+            thumb = raw.extract_thumb()
+            if thumb.format == rawpy.ThumbFormat.JPEG:
+                img = Image.open(io.BytesIO(thumb.data))
+            else:
+                img = Image.fromarray(thumb.data)
+            if max(img.size) >= wanted:
+                return orient_image(img, orientation), 'rawpy_thumb'
+        except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+            pass
+
+        # postprocess() already applies the sensor orientation
+        rgb = raw.postprocess(**raw_postprocess_params(profile))
+    return Image.fromarray(rgb), 'demosaic'
+
+def thumbnail_profile(image_path):
+    """RAW render profile thumbnails of a file are rendered with ('' for non-RAWs)"""
+    return raw_profile() if is_raw_file(image_path) else ''
+
+def generate_thumbnail(image_path, tier=DEFAULT_THUMBNAIL_TIER, fmt='jpeg'):
+    """Generate thumbnail tiers for image or video; returns the requested variant's path"""
     try:
         # Check if it's a video file
         if is_video_file(image_path):
-            return generate_video_thumbnail(image_path)
+            return generate_video_thumbnail(image_path, tier, fmt)
 
         # Check if thumbnail already exists
         file_hash = get_file_hash(image_path)
-        thumbnail_path = os.path.join(THUMBNAIL_DIR, f"{file_hash}.jpg")
+        profile = thumbnail_profile(image_path)
+        paths = thumbnail_paths(file_hash, dict.fromkeys([fmt, *thumbnail_formats()]), profile)
 
-        if os.path.exists(thumbnail_path):
-            return thumbnail_path
+        if render_cache.find_cached(load_config()['catalog_path'], THUMBNAIL_DIR, paths[tier, fmt]):
+            return paths[tier, fmt]
 
-        # Generate new thumbnail for image
-        if is_raw_file(image_path):
-            try:
-                import rawpy
-                import imageio
-                with rawpy.imread(image_path) as raw:
-                    rgb = raw.postprocess()
-                img = Image.fromarray(rgb)
-            except Exception as e:
-                print(f"Error processing RAW {image_path}: {e}")
+        # Only one worker decodes a given file; the others wait for its result
+        with render_cache.single_flight(render_cache.cache_path(THUMBNAIL_DIR, file_hash, '.jpg'), LOCK_DIR):
+            variants = missing_variants(paths)
+            if (tier, fmt) not in variants:
+                return paths[tier, fmt]
+
+            if not offload('thumbnail', image_path, file_hash, paths, variants, profile):
                 return None
-        else:
-            img = Image.open(image_path)
+            return paths[tier, fmt]
+    except DecoderBusy:
+        raise
+    except Exception as e:
+        print(f"Error generating thumbnail for {image_path}: {e}")
+        return None
 
-        # Apply EXIF orientation correction (fixes rotated photos)
-        img = ImageOps.exif_transpose(img) if img else img
+def render_thumbnail(image_path, file_hash, paths, variants, profile=''):
+    """Decode an image once and save the missing thumbnail variants (RAWs
+    demosaiced with profile when they carry no usable preview)"""
+    box = (max(tier for tier, _ in variants),) * 2
 
-        # Resize maintaining aspect ratio
-        img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    # Generate new thumbnail for image
+    if is_raw_file(image_path):
+        try:
+            img, source = load_raw_preview(image_path, max(box), raw_profile(profile))
+        except DecoderBusy:
+            raise
+        except Exception as e:
+            print(f"Error processing RAW {image_path}: {e}")
+            return False
+        try:
+            ext = os.path.splitext(image_path)[1].lower()
+            catalog.record_render_source(load_config()['catalog_path'], ext, source)
+        except Exception as e:
+            print(f"Error recording thumbnail source: {e}")
+    else:
+        img = Image.open(image_path)
+        # Decode at the smallest DCT scale that still covers the thumbnail
+        draft_jpeg(img, box)
+
+    # Apply EXIF orientation correction (fixes rotated photos)
+    img = ImageOps.exif_transpose(img) if img else img
+
+    # Resize maintaining aspect ratio, every missing variant from this decode
+    save_thumbnail_tiers(img, file_hash, paths, variants)
+    return True
+
+def preview_jpeg_options(**options):
+    """JPEG save options of RAW previews and display copies, progressive when
+    configured so slow links paint a coarse image after the first scan"""
+    if load_config()['progressive_previews']:
+        options['progressive'] = True
+    return options
+
+def preview_encoding():
+    """Cache name and ETag suffix of the preview_jpeg_options() encoding, so
+    toggling progressive_previews renders and serves new files"""
+    return 'p' if load_config()['progressive_previews'] else ''
+
+def raw_preview_name(profile):
+    """Cache name and ETag variant of a RAW's display preview with a render profile"""
+    if profile == 'full':
+        return f'previewfull{preview_encoding()}'
+    return f"preview{load_config()['raw_preview_long_edge']}{profile}{preview_encoding()}"
+
+def generate_raw_preview(image_path, profile=None):
+    """Render a RAW for display once and cache it next to the thumbnails
+
+    At raw_preview_long_edge px, except the full profile (full resolution
+    mode, zoom), which keeps the sensor resolution.
+    """
+    try:
+        profile = raw_profile(profile)
+        long_edge = 0 if profile == 'full' else load_config()['raw_preview_long_edge']
+        file_hash = get_file_hash(image_path)
+        preview_path = render_cache.cache_path(THUMBNAIL_DIR, file_hash, f'_{raw_preview_name(profile)}.jpg')
 
-        # Save thumbnail
-        img.save(thumbnail_path, 'JPEG', quality=78, optimize=True)
-        return thumbnail_path
+        if render_cache.find_cached(load_config()['catalog_path'], THUMBNAIL_DIR, preview_path):
+            return preview_path
+
+        # Only one worker develops a given file; the others wait for its result
+        with render_cache.single_flight(preview_path, LOCK_DIR):
+            if os.path.exists(preview_path):
+                return preview_path
+
+            offload('raw_preview', image_path, file_hash, preview_path, long_edge, profile)
+            return preview_path
+    except DecoderBusy:
+        raise
     except Exception as e:
-        print(f"Error generating thumbnail for {image_path}: {e}")
+        print(f"Error generating RAW preview for {image_path}: {e}")
         return None
 
+def render_raw_preview(image_path, file_hash, preview_path, long_edge, profile):
+    """Develop a RAW and save its display preview (long_edge 0: sensor resolution)"""
+    # Embedded preview when it is large enough, full demosaic otherwise
+    img, source = load_raw_preview(image_path, long_edge, profile)
+    img = ImageOps.exif_transpose(img)
+    if long_edge:
+        img.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS)
+
+    render_cache.save_image(img, preview_path, 'JPEG', **preview_jpeg_options(quality=90, optimize=True))
+    track_cache_file(preview_path, file_hash)
+    return True
+
+def display_size(img_size, width, height):
+    """Smallest display long edge that fills a width x height viewport"""
+    scale = min(width / img_size[0], height / img_size[1])
+    needed = max(img_size) * scale
+    for size in DISPLAY_SIZES:
+        if size >= needed:
+            return size
+    return DISPLAY_SIZES[-1]
+
+def oriented_size(img):
+    """Size of an opened image once its EXIF orientation is applied (no decode)"""
+    if img.getexif().get(0x0112) in (5, 6, 7, 8):
+        return img.size[::-1]
+    return img.size
+
+def generate_display_image(image_path, source_file, long_edge, profile=''):
+    """Downscaled display copy of an image (source_file is the JPG, or a RAW's
+    cached preview rendered with profile)"""
+    try:
+        file_hash = get_file_hash(image_path)
+        display_path = render_cache.cache_path(THUMBNAIL_DIR, file_hash, f'_display{long_edge}{profile}{preview_encoding()}.jpg')
+
+        if render_cache.find_cached(load_config()['catalog_path'], THUMBNAIL_DIR, display_path):
+            return display_path
+
+        # Only one worker decodes a given file; the others wait for its result
+        with render_cache.single_flight(display_path, LOCK_DIR):
+            if os.path.exists(display_path):
+                return display_path
+
+            offload('display_image', source_file, file_hash, display_path, long_edge)
+            return display_path
+    except DecoderBusy:
+        raise
+    except Exception as e:
+        print(f"Error generating display image for {image_path}: {e}")
+        return None
+
+def render_display_image(source_file, file_hash, display_path, long_edge):
+    """Downscale a JPG to a display long edge and save it"""
+    img = Image.open(source_file)
+    # Decode at the smallest DCT scale that still covers the display size
+    draft_jpeg(img, (long_edge, long_edge))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    render_cache.save_image(img, display_path, 'JPEG', **preview_jpeg_options(quality=88))
+    track_cache_file(display_path, file_hash)
+    return True
+
+def fitted_long_edge(source_file, width, height):
+    """Long edge of the display copy that fills a width x height viewport,
+    or 0 when source_file is not larger and goes out untouched"""
+    with Image.open(source_file) as img:
+        size = oriented_size(img)
+    long_edge = display_size(size, width, height)
+    # Never upscale: smaller images go out untouched
+    return 0 if long_edge >= max(size) else long_edge
+
+def fitted_image(image_path, source_file, width, height, profile=''):
+    """File to show for a width x height viewport: a cached display copy, or
+    source_file itself when it is not larger than the display size"""
+    try:
+        long_edge = fitted_long_edge(source_file, width, height)
+    except Exception as e:
+        print(f"Error reading image size of {image_path}: {e}")
+        return None
+    if not long_edge:
+        return source_file
+    return generate_display_image(image_path, source_file, long_edge, profile)
+
+def prefetch_image(image_path, viewport):
+    """Background job: warm what /api/image will serve for a viewport ('WxH', '' for full resolution)"""
+    profile = ''
+    source_file = image_path
+    if is_raw_file(image_path):
+        # Full resolution mode asks for full-quality RAW renders
+        profile = raw_profile(None if viewport else 'full')
+        source_file = generate_raw_preview(image_path, profile)
+    if not source_file:
+        return None
+    if not viewport:
+        return source_file
+    width, height = (int(value) for value in viewport.split('x'))
+    return fitted_image(image_path, source_file, width, height, profile)
+
+def zoom_source(image_path, profile=''):
+    """File the tile pyramid is cut from: the JPG itself or a RAW's cached
+    preview rendered with profile (sensor resolution for 'full')"""
+    if is_raw_file(image_path):
+        return generate_raw_preview(image_path, profile)
+    return image_path
+
+def tile_prefix(size, level, profile=''):
+    """Cache name prefix of a pyramid level's tiles"""
+    # The source size is part of the name: a RAW preview re-rendered at another size gets new tiles
+    return f'_t{size[0]}x{size[1]}{profile}_{level}'
+
+def generate_tile(image_path, source_file, size, level, x, y, profile=''):
+    """Return a cached pyramid tile, rendering only that tile on first use
+    and queueing the rest of its level for the background workers"""
+    try:
+        config = load_config()
+        file_hash = get_file_hash(image_path)
+        prefix = tile_prefix(size, level, profile)
+        target = render_cache.cache_path(THUMBNAIL_DIR, file_hash, f'{prefix}_{x}_{y}.jpg')
+
+        if render_cache.find_cached(config['catalog_path'], THUMBNAIL_DIR, target):
+            return target
+
+        with render_cache.single_flight(target, LOCK_DIR):
+            if not os.path.exists(target):
+                offload('tile', source_file, file_hash, prefix, size, level, x, y)
+
+        # The viewer asks for the neighbours next: cut them from one decode in the background
+        jobs.enqueue(config['catalog_path'], 'tile_level', image_path, [image_path], f'{level}:{profile}')
+        return target
+    except DecoderBusy:
+        raise
+    except Exception as e:
+        print(f"Error generating tile {level}/{x}_{y} for {image_path}: {e}")
+        return None
+
+def open_tile_source(source_file, level_size):
+    """Open a zoom source oriented, decoded no larger than needed for a level"""
+    img = Image.open(source_file)
+    draft_jpeg(img, level_size)
+    return ImageOps.exif_transpose(img)
+
+def render_tile(source_file, file_hash, prefix, size, level, x, y):
+    """Decode a source scaled to a pyramid level and save one tile of it"""
+    level_size = tiles.level_size(size[0], size[1], level)
+    tile = tiles.cut_tile(open_tile_source(source_file, level_size), level_size, x, y)
+    tile_path = render_cache.cache_path(THUMBNAIL_DIR, file_hash, f'{prefix}_{x}_{y}.jpg')
+    render_cache.save_image(tile, tile_path, 'JPEG', quality=85)
+    track_cache_file(tile_path, file_hash)
+    return True
+
+def render_tile_level(source_file, file_hash, prefix, size, level):
+    """Decode a source once at a pyramid level and save every tile of it not cached yet"""
+    level_size = tiles.level_size(size[0], size[1], level)
+    img = open_tile_source(source_file, level_size)
+    for (tile_x, tile_y), tile in tiles.cut_tiles(img, level_size):
+        tile_path = render_cache.cache_path(THUMBNAIL_DIR, file_hash, f'{prefix}_{tile_x}_{tile_y}.jpg')
+        if not os.path.exists(tile_path):
+            render_cache.save_image(tile, tile_path, 'JPEG', quality=85)
+            track_cache_file(tile_path, file_hash)
+    return True
+
+def pregenerate_tile_level(image_path, level, profile=''):
+    """Background job: cut the tiles of a pyramid level that requests did not render"""
+    level = int(level)
+    source_file = zoom_source(image_path, profile)
+    if not source_file:
+        return False
+    with Image.open(source_file) as img:
+        size = oriented_size(img)
+    if not 0 <= level <= tiles.top_level(*size):
+        return False
+    file_hash = get_file_hash(image_path)
+    prefix = tile_prefix(size, level, profile)
+    # One background decode per level even when several workers pick it up
+    with render_cache.single_flight(render_cache.cache_path(THUMBNAIL_DIR, file_hash, prefix), LOCK_DIR):
+        return offload('tile_level', source_file, file_hash, prefix, size, level)
+
+# Decode steps the decode service runs for the web workers (see decoder.py)
+RENDER_TASKS = {
+    'thumbnail': render_thumbnail,
+    'video_thumbnail': render_video_thumbnail,
+    'raw_preview': render_raw_preview,
+    'display_image': render_display_image,
+    'tile': render_tile,
+    'tile_level': render_tile_level,
+}
+
+def offload(task, *args):
+    """Run a RENDER_TASKS step in the decode service, or in this process when
+    no service listens on decoder_socket
+
+    Exceptions raised by the step (DecoderBusy included) are raised here.
+    Requests queued in the service longer than raw_decode_wait, and steps
+    that do not answer in time, raise DecoderBusy too.
+    """
+    config = load_config()
+    if config['decoder_socket']:
+        background = jobs.in_background()
+        # Give up before the workers waiting on our single-flight lock do, or they start the same decode
+        timeout = min(config['decoder_timeout'], render_cache.LOCK_TIMEOUT - DECODER_LOCK_MARGIN)
+        try:
+            return decoder.call(config['decoder_socket'], task, args, background, timeout,
+                                None if background else config['raw_decode_wait'])
+        except decoder.DecoderUnavailable:
+            pass
+        except TimeoutError as e:
+            print(f"Error running {task} in the decode service: {e}")
+            raise DecoderBusy(max(1, round(config['raw_decode_wait'] / 4)))
+    return RENDER_TASKS[task](*args)
+
+# Set once this worker's background maintenance is running
+_background_started = False
+
+@app.before_request
+def start_background_tasks():
+    """Start per-worker background maintenance on the first request"""
+    global _background_started
+    if _background_started:
+        return
+    config = load_config()
+    render_cache.start_migration(config['catalog_path'], THUMBNAIL_DIR, LOCK_DIR)
+    jobs.start_workers(config['catalog_path'], {
+        'thumbnail': lambda path, arg: generate_thumbnail(path),
+        'prefetch': prefetch_image,
+        'tile_level': lambda path, arg: pregenerate_tile_level(path, *arg.split(':'))
+    }, config['pregenerate_workers'])
+    # start_migration() and start_workers() only run once; later requests skip the config read
+    _background_started = True
+
+@app.errorhandler(DecoderBusy)
+def decoder_busy(e):
+    """Every RAW decode slot is taken, or the decode service is backed up: ask
+    the client to come back later"""
+    response = jsonify({'error': 'Decoder busy, retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.route('/')
 def index():
     """Main page"""
@@ -413,9 +962,11 @@ def check_permissions():
 @app.route('/api/browse', methods=['GET'])
 def browse():
     """List folders and files in a path"""
-    path = request.args.get('path', '')
-    config = load_config()
+    payload, status = list_folder(request.args.get('path', ''), load_config())
+    return jsonify(payload), status
 
+def list_folder(path, config):
+    """Body and status of /api/browse (shared with the ASGI server, asgi.py)"""
     # If no path provided, return mount points
     if not path:
         mount_points = []
@@ -426,17 +977,17 @@ def browse():
                     'path': mp,
                     'type': 'directory'
                 })
-        return jsonify({'items': mount_points, 'current_path': ''})
+        return {'items': mount_points, 'current_path': ''}, 200
 
     # Security check
     if not is_path_allowed(path, config['mount_points']):
-        return jsonify({'error': 'Path not allowed'}), 403
+        return {'error': 'Path not allowed'}, 403
 
     if not os.path.exists(path):
-        return jsonify({'error': 'Path does not exist'}), 404
+        return {'error': 'Path does not exist'}, 404
 
     if not os.path.isdir(path):
-        return jsonify({'error': 'Path is not a directory'}), 400
+        return {'error': 'Path is not a directory'}, 400
 
     try:
         items = []
@@ -458,18 +1009,41 @@ def browse():
         # Sort directories alphabetically
         items.sort(key=lambda x: x['name'].lower())
 
-        return jsonify({'items': items, 'current_path': path})
+        return {'items': items, 'current_path': path}, 200
     except PermissionError:
-        return jsonify({'error': 'Permission denied'}), 403
+        return {'error': 'Permission denied'}, 403
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
-@app.route('/api/scan', methods=['GET'])
-def scan():
-    """Scan folder and return JPG files with their paired RAW files, plus orphan RAW files and videos"""
-    path = request.args.get('path', '')
-    config = load_config()
+def load_cached_metadata(config, path):
+    """Catalog snapshot of a folder; metadata of unchanged files is reused"""
+    try:
+        return catalog.load_folder(config['catalog_path'], path)
+    except Exception as e:
+        print(f"Error reading catalog for {path}: {e}")
+        return {}
+
+def save_cached_metadata(config, path, media, cached, updated):
+    """Store freshly extracted metadata and forget files that are gone"""
+    try:
+        sources = {source[0] for _, source in media if source}
+        if updated or len(cached) != len(sources):
+            catalog.store_folder(config['catalog_path'], path, updated, sources)
+    except Exception as e:
+        print(f"Error updating catalog for {path}: {e}")
 
+def queue_thumbnails(config, path, media):
+    """Queue background thumbnails for a folder in grid order"""
+    if not config['pregenerate_thumbnails']:
+        return
+    try:
+        jobs.enqueue(config['catalog_path'], 'thumbnail', path,
+                     [item['display_path'] for item, _ in media])
+    except Exception as e:
+        print(f"Error queueing thumbnails for {path}: {e}")
+
+def check_scan_path(path, config):
+    """Validate a folder to scan; returns an error response or None"""
     if not path:
         return jsonify({'error': 'Path required'}), 400
 
@@ -480,109 +1054,166 @@ def scan():
     if not os.path.exists(path) or not os.path.isdir(path):
         return jsonify({'error': 'Invalid directory'}), 400
 
+    return None
+
+@app.route('/api/scan', methods=['GET'])
+def scan():
+    """Scan folder and return JPG files with their paired RAW files, plus orphan RAW files and videos"""
+    path = request.args.get('path', '')
+    config = load_config()
+
+    error = check_scan_path(path, config)
+    if error:
+        return error
+
     try:
+        # Single directory listing; pairing comes from the stem index, not extra stats
+        media = list_media(path)
+        queue_thumbnails(config, path, media)
+        cached = load_cached_metadata(config, path)
+
+        # Extract metadata of new or changed files in parallel
+        stale = find_stale_sources(media, cached)
+        extracted = extract_all(
+            functools.partial(extract_exif_data, debug=EXIF_DEBUG), list(stale),
+            config['scan_workers'], config['exif_timeout']
+        )
+        # Failed or timed out files stay out of the catalog and are retried next scan
+        updated = [catalog_entry(item, exif_source, extracted[exif_source[0]])
+                   for item, exif_source in stale.values() if extracted[exif_source[0]] is not None]
+
         photos = []
-        processed_raws = set()
+        for item, exif_source in media:
+            # Rule: If JPG+RAW paired, use RAW data; otherwise use JPG data
+            if exif_source:
+                source_path = exif_source[0]
+                if source_path in extracted:
+                    apply_exif(item, extracted[source_path] or {})
+                else:
+                    apply_exif(item, cached[source_path][2])
+            photos.append(item)
+
+        save_cached_metadata(config, path, media, cached, updated)
 
-        # First pass: collect all JPG files with their paired RAWs
-        for entry in os.scandir(path):
-            try:
-                if entry.is_file() and is_jpg_file(entry.name):
-                    raw_file = find_paired_raw(entry.path)
+        return jsonify({'photos': photos, 'count': len(photos)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/scan/stream', methods=['GET'])
+def scan_stream():
+    """Scan folder as newline-delimited JSON: the listing first, then EXIF as it is extracted
+
+    Records:
+      {"event": "photo", "index": i, "photo": {...}}   one per entry, /api/scan shape
+      {"event": "listed", "count": n}                  listing complete
+      {"event": "exif", "index": i, "camera_brand": ...}  metadata for entry i
+      {"event": "done", "count": n} or {"event": "error", "error": "..."}
+    """
+    path = request.args.get('path', '')
+    config = load_config()
+
+    error = check_scan_path(path, config)
+    if error:
+        return error
 
-                    # Extract EXIF data
-                    # Rule: If JPG+RAW paired, use RAW data; otherwise use JPG data
+    def record(data):
+        return json.dumps(data) + '\n'
+
+    def generate():
+        try:
+            media = list_media(path)
+        except Exception as e:
+            yield record({'event': 'error', 'error': str(e)})
+            return
+
+        queue_thumbnails(config, path, media)
+        cached = load_cached_metadata(config, path)
+        stale = find_stale_sources(media, cached)
+
+        # Cheap listing first; files unchanged since the last scan already carry EXIF
+        indexes = {}
+        for index, (item, exif_source) in enumerate(media):
+            if exif_source:
+                source_path = exif_source[0]
+                if source_path in stale:
+                    indexes.setdefault(source_path, []).append(index)
+                else:
+                    apply_exif(item, cached[source_path][2])
+            yield record({'event': 'photo', 'index': index, 'photo': item})
+        yield record({'event': 'listed', 'count': len(media)})
+
+        # Enrichment records in completion order
+        updated = []
+        try:
+            extracted = iter_extract(
+                functools.partial(extract_exif_data, debug=EXIF_DEBUG), list(stale),
+                config['scan_workers'], config['exif_timeout']
+            )
+            for source_path, exif_data in extracted:
+                if exif_data is None:
+                    # Failed or timed out: not stored, so the next scan retries it
                     exif_data = {}
-                    if raw_file:
-                        exif_data = extract_exif_data(raw_file, debug=EXIF_DEBUG)
-                        processed_raws.add(raw_file)
-                    else:
-                        exif_data = extract_exif_data(entry.path, debug=EXIF_DEBUG)
+                else:
+                    item, exif_source = stale[source_path]
+                    updated.append(catalog_entry(item, exif_source, exif_data))
+                fields = {field: exif_data.get(field) for field in EXIF_FIELDS
+                          if exif_data.get(field) is not None}
+                for index in indexes[source_path]:
+                    yield record({'event': 'exif', 'index': index, **fields})
+            yield record({'event': 'done', 'count': len(media)})
+        except Exception as e:
+            yield record({'event': 'error', 'error': str(e)})
+        finally:
+            # Keep whatever was extracted even if the client went away
+            save_cached_metadata(config, path, media, cached, updated)
 
-                    # Get file size (JPG + RAW if exists)
-                    file_size = entry.stat().st_size
-                    if raw_file and os.path.exists(raw_file):
-                        file_size += os.path.getsize(raw_file)
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-                    photos.append({
-                        'jpg': entry.path,
-                        'raw': raw_file,
-                        'name': entry.name,
-                        'type': 'jpg+raw' if raw_file else 'jpg_only',
-                        'media_type': 'image',
-                        'camera_brand': exif_data.get('camera_brand', ''),
-                        'camera_model': exif_data.get('camera_model', ''),
-                        'iso': exif_data.get('iso'),
-                        'aperture': exif_data.get('aperture'),
-                        'shutter_speed': exif_data.get('shutter_speed'),
-                        'date': exif_data.get('date', ''),
-                        'size': file_size,
-                        'display_path': entry.path  # Path to use for display (thumbnail/image)
-                    })
-            except Exception as e:
-                print(f"Error processing {entry.name}: {e}")
-                continue
+def source_validators(path, variant=''):
+    """(version, etag, mtime) of a response rendered from a source file
 
-        # Second pass: find orphan RAW files (RAWs without JPG)
-        for entry in os.scandir(path):
-            try:
-                if entry.is_file() and is_raw_file(entry.name):
-                    if entry.path not in processed_raws:
-                        # This is an orphan RAW - extract EXIF from RAW
-                        exif_data = extract_exif_data(entry.path, debug=EXIF_DEBUG)
-                        file_size = entry.stat().st_size
-
-                        photos.append({
-                            'jpg': None,
-                            'raw': entry.path,
-                            'name': entry.name,
-                            'type': 'raw_only',
-                            'media_type': 'image',
-                            'camera_brand': exif_data.get('camera_brand', ''),
-                            'camera_model': exif_data.get('camera_model', ''),
-                            'iso': exif_data.get('iso'),
-                            'aperture': exif_data.get('aperture'),
-                            'shutter_speed': exif_data.get('shutter_speed'),
-                            'date': exif_data.get('date', ''),
-                            'size': file_size,
-                            'display_path': entry.path  # Use RAW for display
-                        })
-            except Exception as e:
-                print(f"Error processing orphan RAW {entry.name}: {e}")
-                continue
+    The ETag comes from the source's size and mtime (plus the rendering
+    variant), so it can be checked without touching the decoder or cache.
+    """
+    stat = os.stat(path)
+    version = file_version(stat.st_size, stat.st_mtime_ns)
+    etag = f'{version}-{variant}' if variant else version
+    return version, etag, stat.st_mtime
 
-        # Third pass: collect video files
-        for entry in os.scandir(path):
-            try:
-                if entry.is_file() and is_video_file(entry.name):
-                    file_size = entry.stat().st_size
+def validators_match(if_none_match, if_modified_since, etag, mtime):
+    """Whether If-None-Match (weak comparison, RFC 9110), or else
+    If-Modified-Since, header values match the current source
 
-                    photos.append({
-                        'jpg': None,
-                        'raw': None,
-                        'video': entry.path,
-                        'name': entry.name,
-                        'type': 'video',
-                        'media_type': 'video',
-                        'camera_brand': '',
-                        'camera_model': '',
-                        'iso': None,
-                        'aperture': None,
-                        'shutter_speed': None,
-                        'date': '',
-                        'size': file_size,
-                        'display_path': entry.path  # Use video path for thumbnail
-                    })
-            except Exception as e:
-                print(f"Error processing video {entry.name}: {e}")
-                continue
+    Shared by the Flask routes and asgi.py so both answer 304 alike.
+    """
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    if if_modified_since:
+        since = parse_date(if_modified_since)
+        return since is not None and int(mtime) <= since.timestamp()
+    return False
 
-        # Sort by filename
-        photos.sort(key=lambda x: x['name'].lower())
+def is_not_modified(etag, mtime):
+    """Whether the client's conditional headers match the current source"""
+    return validators_match(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'),
+                            etag, mtime)
+
+def cache_headers(response, version, etag, mtime):
+    """Set validators and cache policy; versioned URLs are immutable"""
+    response.set_etag(etag)
+    response.last_modified = int(mtime)
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-        return jsonify({'photos': photos, 'count': len(photos)})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+def not_modified_response(version, etag, mtime):
+    """Empty 304 carrying the same validators as the full response"""
+    return cache_headers(app.response_class(status=304), version, etag, mtime)
 
 @app.route('/api/thumbnail', methods=['GET'])
 def thumbnail():
@@ -600,16 +1231,132 @@ def thumbnail():
     if not os.path.exists(path):
         return jsonify({'error': 'File does not exist'}), 404
 
-    thumbnail_path = generate_thumbnail(path)
+    tier = thumbnail_tier(request.args.get('size', DEFAULT_THUMBNAIL_TIER, type=int))
+    fmt = negotiate_thumbnail_format()
+    version, etag, mtime = source_validators(path, f'{tier}{fmt}{thumbnail_profile(path)}')
+    if is_not_modified(etag, mtime):
+        response = not_modified_response(version, etag, mtime)
+        response.vary.add('Accept')
+        return response
+
+    thumbnail_path = generate_thumbnail(path, tier, fmt)
     if thumbnail_path and os.path.exists(thumbnail_path):
-        return send_file(thumbnail_path, mimetype='image/jpeg')
+        render_cache.touch(config['catalog_path'], THUMBNAIL_DIR, thumbnail_path)
+        response = send_file(thumbnail_path, mimetype=THUMBNAIL_FORMATS[fmt][0],
+                             etag=etag, last_modified=mtime)
+        # The body depends on the Accept header
+        response.vary.add('Accept')
+        return cache_headers(response, version, etag, mtime)
     else:
         return jsonify({'error': 'Failed to generate thumbnail'}), 500
 
+@app.route('/api/thumbnails/progress', methods=['GET'])
+def thumbnails_progress():
+    """Background thumbnail generation progress of a folder"""
+    path = request.args.get('path', '')
+    config = load_config()
+
+    if not path:
+        return jsonify({'error': 'Path required'}), 400
+
+    if not is_path_allowed(path, config['mount_points']):
+        return jsonify({'error': 'Path not allowed'}), 403
+
+    try:
+        return jsonify(jobs.progress(config['catalog_path'], 'thumbnail', path))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/prefetch', methods=['POST'])
+def prefetch():
+    """Warm RAW previews and display copies around the carousel position
+
+    Body: {"folder": ..., "paths": [...most urgent first], "w": ..., "h": ...}
+    (w/h omitted in full resolution mode). Replaces the folder's previous
+    prefetch window, so work for photos the user jumped away from is dropped.
+    """
+    data = request.json or {}
+    folder = data.get('folder', '')
+    width = data.get('w')
+    height = data.get('h')
+    config = load_config()
+
+    if not folder:
+        return jsonify({'error': 'Folder required'}), 400
+
+    paths = [path for path in data.get('paths', [])
+             if isinstance(path, str) and not is_video_file(path)]
+    if not all(is_path_allowed(path, config['mount_points']) for path in [folder, *paths]):
+        return jsonify({'error': 'Path not allowed'}), 403
+
+    try:
+        viewport = f'{int(width)}x{int(height)}' if width and height else ''
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid viewport'}), 400
+
+    try:
+        jobs.enqueue(config['catalog_path'], 'prefetch', folder, paths, viewport)
+        return jsonify({'success': True, 'queued': len(paths)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/thumbnail/stats', methods=['GET'])
+def thumbnail_stats():
+    """Report, per RAW format, which rendering path produced the thumbnails"""
+    config = load_config()
+    try:
+        stats = catalog.render_source_stats(config['catalog_path'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    formats = {}
+    for ext, sources in sorted(stats.items()):
+        total = sum(sources.values())
+        formats[ext] = {
+            'embedded': sources.get('embedded', 0),
+            'rawpy_thumb': sources.get('rawpy_thumb', 0),
+            'demosaic': sources.get('demosaic', 0),
+            'total': total,
+            'preview_hit_rate': round((total - sources.get('demosaic', 0)) / total, 3) if total else 0
+        }
+    return jsonify({'formats': formats})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Size, budget and hit counts of the thumbnail cache"""
+    config = load_config()
+    try:
+        return jsonify(render_cache.cache_stats(
+            config['catalog_path'], config['thumbnail_cache_max_mb'] * 1024 * 1024,
+            config['thumbnail_cache_policy']
+        ))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/sweep', methods=['POST'])
+def cache_sweep():
+    """Remove thumbnails of deleted files and enforce the cache budget"""
+    config = load_config()
+    try:
+        result = render_cache.sweep_cache(
+            config['catalog_path'], THUMBNAIL_DIR, config['thumbnail_cache_max_mb'] * 1024 * 1024,
+            config['thumbnail_cache_policy'], config['mount_points']
+        )
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/image', methods=['GET'])
 def image():
-    """Return full size image (or convert RAW to JPG if needed)"""
+    """Return an image for display (or convert RAW to JPG if needed)
+
+    With w and h (viewport size in device pixels) a downscaled copy that
+    fills the viewport is served from the cache; without them the original
+    JPG (or the RAW preview) is sent at full resolution.
+    """
     path = request.args.get('path', '')
+    width = request.args.get('w', type=int)
+    height = request.args.get('h', type=int)
     config = load_config()
 
     if not path:
@@ -626,56 +1373,263 @@ def image():
     if is_video_file(path):
         return jsonify({'error': 'Use /api/video endpoint for videos'}), 400
 
-    # If it's a RAW file, convert to JPG for display
+    fit = width is not None and height is not None and width > 0 and height > 0
+    variant = []
+    profile = ''
+    # If it's a RAW file, start from its cached display preview
+    source_file = path
     if is_raw_file(path):
+        # profile=full asks for a full-quality render (full resolution mode)
+        profile = raw_profile(request.args.get('profile'))
+        variant.append(raw_preview_name(profile))
+        source_file = generate_raw_preview(path, profile)
+        if not source_file:
+            return jsonify({'error': 'Failed to process RAW file'}), 500
+
+    long_edge = 0
+    if fit:
+        # Viewports sharing a display size bucket get the same file, and the same ETag
         try:
-            import rawpy
-            with rawpy.imread(path) as raw:
-                rgb = raw.postprocess()
-            img = Image.fromarray(rgb)
-
-            # Save to BytesIO to send
-            img_io = io.BytesIO()
-            img.save(img_io, 'JPEG', quality=90, optimize=True)
-            img_io.seek(0)
-            return send_file(img_io, mimetype='image/jpeg')
+            long_edge = fitted_long_edge(source_file, width, height)
         except Exception as e:
-            print(f"Error converting RAW to display: {e}")
-            return jsonify({'error': 'Failed to process RAW file'}), 500
+            print(f"Error reading image size of {path}: {e}")
+            return jsonify({'error': 'Failed to resize image'}), 500
+        variant.append(f'fit{long_edge}{preview_encoding()}' if long_edge else 'fit')
+    version, etag, mtime = source_validators(path, '-'.join(variant))
+    if is_not_modified(etag, mtime):
+        return not_modified_response(version, etag, mtime)
+
+    if source_file != path:
+        render_cache.touch(config['catalog_path'], THUMBNAIL_DIR, source_file)
+
+    if long_edge:
+        display_path = generate_display_image(path, source_file, long_edge, profile)
+        if not display_path:
+            return jsonify({'error': 'Failed to resize image'}), 500
+        render_cache.touch(config['catalog_path'], THUMBNAIL_DIR, display_path)
+        source_file = display_path
+
+    response = send_file(source_file, mimetype='image/jpeg', etag=etag, last_modified=mtime)
+    return cache_headers(response, version, etag, mtime)
+
+def check_image_path(path, config):
+    """Validate an image to zoom into; returns an error response or None"""
+    if not path:
+        return jsonify({'error': 'Path required'}), 400
 
-    return send_file(path, mimetype='image/jpeg')
+    # Security check
+    if not is_path_allowed(path, config['mount_points']):
+        return jsonify({'error': 'Path not allowed'}), 403
 
-@app.route('/api/video', methods=['GET'])
-def video():
-    """Return video file"""
+    if not os.path.exists(path):
+        return jsonify({'error': 'File does not exist'}), 404
+
+    if is_video_file(path):
+        return jsonify({'error': 'Not an image'}), 400
+
+    return None
+
+def zoom_profile(path):
+    """RAW render profile of a zoom request ('' for non-RAWs): the display
+    preview's unless profile=full asks for a sensor-resolution render"""
+    return raw_profile(request.args.get('profile')) if is_raw_file(path) else ''
+
+def zoom_variant(path, profile, *parts):
+    """ETag variant of zoom responses; RAW pyramids are cut from the preview of profile"""
+    if profile:
+        parts = (raw_preview_name(profile), *parts)
+    return '-'.join(str(part) for part in parts)
+
+@app.route('/api/tiles/info', methods=['GET'])
+def tiles_info():
+    """Deep-zoom descriptor (size, tile size, levels) of an image"""
+    path = request.args.get('path', '')
+    config = load_config()
+
+    error = check_image_path(path, config)
+    if error:
+        return error
+
+    profile = zoom_profile(path)
+    version, etag, mtime = source_validators(path, zoom_variant(path, profile, 'dzi'))
+    if is_not_modified(etag, mtime):
+        return not_modified_response(version, etag, mtime)
+
+    source_file = zoom_source(path, profile)
+    if not source_file:
+        return jsonify({'error': 'Failed to process RAW file'}), 500
+    try:
+        with Image.open(source_file) as img:
+            width, height = oriented_size(img)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(tiles.pyramid_info(width, height))
+    return cache_headers(response, version, etag, mtime)
+
+@app.route('/api/tiles', methods=['GET'])
+def tile():
+    """One tile of an image's deep-zoom pyramid (level, x, y as in DZI)"""
     path = request.args.get('path', '')
+    level = request.args.get('level', type=int)
+    x = request.args.get('x', type=int)
+    y = request.args.get('y', type=int)
     config = load_config()
 
+    error = check_image_path(path, config)
+    if error:
+        return error
+
+    if level is None or x is None or y is None:
+        return jsonify({'error': 'level, x and y required'}), 400
+
+    profile = zoom_profile(path)
+    version, etag, mtime = source_validators(path, zoom_variant(path, profile, level, x, y))
+    if is_not_modified(etag, mtime):
+        return not_modified_response(version, etag, mtime)
+
+    source_file = zoom_source(path, profile)
+    if not source_file:
+        return jsonify({'error': 'Failed to process RAW file'}), 500
+    try:
+        with Image.open(source_file) as img:
+            size = oriented_size(img)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    columns, rows = tiles.tile_counts(tiles.level_size(size[0], size[1], level)) \
+        if 0 <= level <= tiles.top_level(*size) else (0, 0)
+    if not (0 <= x < columns and 0 <= y < rows):
+        return jsonify({'error': 'Tile out of range'}), 404
+
+    tile_path = generate_tile(path, source_file, size, level, x, y, profile)
+    if not tile_path:
+        return jsonify({'error': 'Failed to generate tile'}), 500
+    render_cache.touch(config['catalog_path'], THUMBNAIL_DIR, tile_path)
+    response = send_file(tile_path, mimetype='image/jpeg', etag=etag, last_modified=mtime)
+    return cache_headers(response, version, etag, mtime)
+
+def video_path_error(path, config):
+    """(message, status) when path cannot be streamed as a video, else None"""
     if not path:
-        return jsonify({'error': 'Path required'}), 400
+        return 'Path required', 400
 
     # Security check
     if not is_path_allowed(path, config['mount_points']):
-        return jsonify({'error': 'Path not allowed'}), 403
+        return 'Path not allowed', 403
 
     if not os.path.exists(path):
-        return jsonify({'error': 'File does not exist'}), 404
+        return 'File does not exist', 404
 
     if not is_video_file(path):
-        return jsonify({'error': 'Not a video file'}), 400
+        return 'Not a video file', 400
+    return None
 
-    # Determine mimetype based on extension
+def video_mimetype(path):
+    """Determine mimetype based on extension"""
     ext = os.path.splitext(path)[1].lower()
-    mimetype_map = {
-        '.mp4': 'video/mp4',
-        '.mov': 'video/quicktime',
-        '.mkv': 'video/x-matroska',
-        '.avi': 'video/x-msvideo',
-        '.m4v': 'video/mp4'
-    }
-    mimetype = mimetype_map.get(ext, 'video/mp4')
+    return VIDEO_MIMETYPES.get(ext, 'video/mp4')
+
+def open_video_stream(path, config, client):
+    """Open a video for streaming to client, or None when the client already
+    has video_streams_per_client streams open (see streaming.py)"""
+    slot = None
+    limit = config['video_streams_per_client']
+    if limit > 0:
+        slot = streaming.acquire_slot(os.path.join(LOCK_DIR, 'streams'), client, limit)
+        if not slot:
+            return None
+    try:
+        return streaming.StreamFile(path, slot)
+    except OSError:
+        if slot:
+            slot.close()
+        raise
+
+def video_ranges(size, range_header, if_range, etag, mtime, config):
+    """Byte ranges to answer: None for the whole file, [] when none is satisfiable (416)
+
+    Single ranges, and the whole file, are capped at video_range_max_mb.
+    """
+    max_bytes = config['video_range_max_mb'] * 1024 * 1024
+    ranges = None
+    if range_header and streaming.if_range_matches(if_range, etag, mtime):
+        ranges = streaming.parse_ranges(range_header, size)
+    if ranges is None:
+        if not max_bytes or size <= max_bytes:
+            return None
+        # Too large to send in one go: a first piece, as for "bytes=0-"
+        ranges = [(0, size - 1)]
+    if len(ranges) == 1:
+        # Open-ended ranges ("bytes=0-") come back shorter; the player asks for the rest
+        ranges = [streaming.limit_range(*ranges[0], max_bytes)]
+    return ranges
+
+def limit_send_stall(environ):
+    """Make sends to this request's client fail once it reads nothing for
+    VIDEO_STALL_SECONDS, so a paused player does not hold a worker thread, a
+    file descriptor and a stream slot (gunicorn and the development server
+    expose the client socket)"""
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is not None:
+        try:
+            sock.settimeout(VIDEO_STALL_SECONDS)
+        except OSError:
+            pass
 
-    return send_file(path, mimetype=mimetype)
+@app.route('/api/video', methods=['GET'])
+def video():
+    """Stream a video, answering single and multiple byte ranges (asgi.py
+    streams it on the event loop instead)"""
+    path = request.args.get('path', '')
+    config = load_config()
+    error = video_path_error(path, config)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    version, etag, mtime = source_validators(path)
+    if is_not_modified(etag, mtime):
+        return not_modified_response(version, etag, mtime)
+
+    stream = open_video_stream(path, config, request.remote_addr or '')
+    if not stream:
+        response = jsonify({'error': 'Too many video streams'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(VIDEO_RETRY_AFTER)
+        return response
+
+    try:
+        limit_send_stall(request.environ)
+        ranges = video_ranges(stream.size, request.headers.get('Range'), request.headers.get('If-Range'),
+                              etag, mtime, config)
+        if ranges == []:
+            stream.close()
+            response = app.response_class(status=416)
+            response.headers['Content-Range'] = f'bytes */{stream.size}'
+            return response
+
+        if ranges and len(ranges) > 1:
+            boundary = secrets.token_hex(16)
+            parts, closing, length = streaming.multipart_layout(ranges, stream.size, video_mimetype(path), boundary)
+            response = app.response_class(streaming.iter_multipart(stream, parts, closing, VIDEO_CHUNK_BYTES),
+                                          status=206, content_type=f'multipart/byteranges; boundary={boundary}')
+            response.content_length = length
+            response.call_on_close(stream.close)
+        else:
+            start, end = ranges[0] if ranges else (0, stream.size - 1)
+            stream.select(start, end)
+            # Passed through untouched so gunicorn can sendfile() the range
+            response = app.response_class(wrap_file(request.environ, stream, VIDEO_CHUNK_BYTES),
+                                          status=206 if ranges else 200, mimetype=video_mimetype(path),
+                                          direct_passthrough=True)
+            response.content_length = end - start + 1
+            if ranges:
+                response.headers['Content-Range'] = f'bytes {start}-{end}/{stream.size}'
+        response.headers['Accept-Ranges'] = 'bytes'
+    except Exception:
+        stream.close()
+        raise
+    return cache_headers(response, version, etag, mtime)
 
 @app.route('/api/move', methods=['POST'])
 def move_files():
@@ -712,17 +1666,20 @@ def move_files():
                 if jpg_path and os.path.exists(jpg_path):
                     jpg_dest = os.path.join(dest_folder, os.path.basename(jpg_path))
                     os.rename(jpg_path, jpg_dest)
+                    render_cache.rename_source(config['catalog_path'], jpg_path, jpg_dest)
                     moved_count += 1
 
                 # Move RAW if exists
                 if raw_path and os.path.exists(raw_path):
                     raw_dest = os.path.join(dest_folder, os.path.basename(raw_path))
                     os.rename(raw_path, raw_dest)
+                    render_cache.rename_source(config['catalog_path'], raw_path, raw_dest)
 
                 # Move video if exists
                 if video_path and os.path.exists(video_path):
                     video_dest = os.path.join(dest_folder, os.path.basename(video_path))
                     os.rename(video_path, video_dest)
+                    render_cache.rename_source(config['catalog_path'], video_path, video_dest)
                     moved_count += 1
             except Exception as e:
                 errors.append(f"Error moving {file_info.get('name', 'unknown')}: {str(e)}")
@@ -767,17 +1724,20 @@ def restore_files():
                 if jpg_path and os.path.exists(jpg_path):
                     jpg_dest = os.path.join(parent_folder, os.path.basename(jpg_path))
                     os.rename(jpg_path, jpg_dest)
+                    render_cache.rename_source(config['catalog_path'], jpg_path, jpg_dest)
                     restored_count += 1
 
                 # Restore RAW if exists
                 if raw_path and os.path.exists(raw_path):
                     raw_dest = os.path.join(parent_folder, os.path.basename(raw_path))
                     os.rename(raw_path, raw_dest)
+                    render_cache.rename_source(config['catalog_path'], raw_path, raw_dest)
 
                 # Restore video if exists
                 if video_path and os.path.exists(video_path):
                     video_dest = os.path.join(parent_folder, os.path.basename(video_path))
                     os.rename(video_path, video_dest)
+                    render_cache.rename_source(config['catalog_path'], video_path, video_dest)
                     restored_count += 1
             except Exception as e:
                 errors.append(f"Error restoring {file_info.get('name', 'unknown')}: {str(e)}")
@@ -831,6 +1791,7 @@ def delete_files():
                         continue
                     if os.path.exists(jpg_path):
                         os.remove(jpg_path)
+                        render_cache.forget_source(config['catalog_path'], THUMBNAIL_DIR, jpg_path)
                         deleted_count += 1
 
                 if raw_path:
@@ -839,6 +1800,7 @@ def delete_files():
                         continue
                     if os.path.exists(raw_path):
                         os.remove(raw_path)
+                        render_cache.forget_source(config['catalog_path'], THUMBNAIL_DIR, raw_path)
 
                 if video_path:
                     if not is_path_allowed(video_path, config['mount_points']):
@@ -846,6 +1808,7 @@ def delete_files():
                         continue
                     if os.path.exists(video_path):
                         os.remove(video_path)
+                        render_cache.forget_source(config['catalog_path'], THUMBNAIL_DIR, video_path)
                         deleted_count += 1
             except Exception as e:
                 errors.append(f"Error deleting {file_info.get('name', 'unknown')}: {str(e)}")
@@ -916,6 +1879,7 @@ def delete_jpgs():
 
                 # Delete only the JPG file
                 os.remove(jpg_path)
+                render_cache.forget_source(config['catalog_path'], THUMBNAIL_DIR, jpg_path)
                 deleted_count += 1
 
             except Exception as e:
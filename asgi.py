@@ -0,0 +1,309 @@
+"""
+SG Photo Reviewer - ASGI entry point
+
+    python3 -m uvicorn asgi:application --host 0.0.0.0 --port 5500 --workers 4
+
+Video streaming and folder listing are served on the event loop: a viewer
+playing a 4 GB MOV holds a coroutine and a file descriptor instead of a
+whole worker, and the blocking parts (scandir, stat, file reads) run in a
+small I/O thread pool. Every other route runs the Flask app (WSGI) in a
+pool of threads, and decoding still happens in the decode service
+(decoder.py) or in those threads.
+"""
+
+import asyncio
+import concurrent.futures
+import email.utils
+import functools
+import io
+import json
+import os
+import secrets
+import sys
+from urllib.parse import parse_qs
+
+from werkzeug.wsgi import FileWrapper
+
+import app
+import streaming
+
+# Bytes read and sent per step of a video stream or Flask file response
+CHUNK_BYTES = 256 * 1024
+# Threads for file system calls; separate from the threads running Flask
+# requests, which can wait minutes on a decode
+IO_THREADS = 16
+# Flask requests handled at once per worker process
+FLASK_THREADS = 32
+# A video stream whose client reads nothing for this long is closed
+STALL_SECONDS = app.VIDEO_STALL_SECONDS
+
+_io_pool = concurrent.futures.ThreadPoolExecutor(IO_THREADS, thread_name_prefix='asgi-io')
+_flask_pool = concurrent.futures.ThreadPoolExecutor(FLASK_THREADS, thread_name_prefix='asgi-flask')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        handler = ROUTES.get(scope['path'])
+        if handler:
+            await handler(scope, receive, send)
+            return
+    await run_flask(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    """Nothing to set up: Flask starts its background threads on first request"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _io_pool.shutdown(wait=False)
+            _flask_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def run_flask(scope, receive, send):
+    """Run a request through the Flask app in a pool thread, streaming its body back"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+
+    loop = asyncio.get_running_loop()
+
+    def send_from_thread(message):
+        # Blocks the Flask thread while the client's socket buffer is full
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    await loop.run_in_executor(_flask_pool, run_wsgi, scope, bytes(body), send_from_thread)
+
+
+def run_wsgi(scope, body, send):
+    """Call the Flask app with a WSGI environ built from an ASGI scope"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['start'] = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        }
+
+    result = app.app(wsgi_environ(scope, body), start_response)
+    try:
+        started = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                send(response['start'])
+                started = True
+            send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            send(response['start'])
+        send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+def wsgi_environ(scope, body):
+    """PEP 3333 environ of an ASGI HTTP request"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # send_file() reads in 8 KB blocks by default; fewer, larger sends
+        'wsgi.file_wrapper': lambda f, buffer_size=8192: FileWrapper(f, max(buffer_size, CHUNK_BYTES)),
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        elif f'HTTP_{name}' in environ:
+            environ[f'HTTP_{name}'] += ',' + value
+        else:
+            environ[f'HTTP_{name}'] = value
+    return environ
+
+
+def in_thread(func, *args):
+    """Run a blocking call in the I/O pool"""
+    return asyncio.get_running_loop().run_in_executor(_io_pool, functools.partial(func, *args))
+
+
+def query(scope):
+    """First value of every query string parameter"""
+    return {key: values[0] for key, values in parse_qs(scope['query_string'].decode()).items()}
+
+
+def request_headers(scope):
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+
+
+async def respond(send, status, headers, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.encode(), str(value).encode()) for name, value in headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def respond_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await respond(send, status, {'content-type': 'application/json', 'content-length': len(body)}, body)
+
+
+def validator_headers(params, version, etag, mtime):
+    """Same validators and cache policy as app.cache_headers()"""
+    return {
+        'etag': f'"{etag}"',
+        'last-modified': email.utils.formatdate(int(mtime), usegmt=True),
+        'cache-control': app.IMMUTABLE_CACHE_CONTROL if params.get('v') == version else 'no-cache',
+    }
+
+
+async def browse(scope, receive, send):
+    """/api/browse without taking a Flask thread"""
+    path = query(scope).get('path', '')
+    payload, status = await in_thread(lambda: app.list_folder(path, app.load_config()))
+    await respond_json(send, payload, status)
+
+
+async def video(scope, receive, send):
+    """/api/video streamed from the event loop, with the Flask route's
+    validation, caching, byte ranges and per-client stream limit"""
+    params = query(scope)
+    path = params.get('path', '')
+    headers = request_headers(scope)
+    config = await in_thread(app.load_config)
+
+    def prepare():
+        error = app.video_path_error(path, config)
+        return error, None if error else app.source_validators(path)
+
+    error, validators = await in_thread(prepare)
+    if error:
+        await respond_json(send, {'error': error[0]}, error[1])
+        return
+
+    version, etag, mtime = validators
+    response_headers = validator_headers(params, version, etag, mtime)
+    if app.validators_match(headers.get('if-none-match'), headers.get('if-modified-since'), etag, mtime):
+        await respond(send, 304, response_headers)
+        return
+
+    client = (scope.get('client') or ('', 0))[0]
+    stream = await in_thread(app.open_video_stream, path, config, client)
+    if not stream:
+        body = json.dumps({'error': 'Too many video streams'}).encode()
+        await respond(send, 429, {'content-type': 'application/json', 'content-length': len(body),
+                                  'retry-after': app.VIDEO_RETRY_AFTER}, body)
+        return
+
+    try:
+        ranges = app.video_ranges(stream.size, headers.get('range'), headers.get('if-range'),
+                                  etag, mtime, config)
+        if ranges == []:
+            await respond(send, 416, {'content-range': f'bytes */{stream.size}'})
+            return
+
+        status = 206 if ranges else 200
+        if ranges and len(ranges) > 1:
+            boundary = secrets.token_hex(16)
+            parts, closing, length = streaming.multipart_layout(ranges, stream.size, app.video_mimetype(path), boundary)
+            segments = [segment for header, start, end in parts for segment in (header, (start, end))] + [closing]
+            response_headers['content-type'] = f'multipart/byteranges; boundary={boundary}'
+        else:
+            start, end = ranges[0] if ranges else (0, stream.size - 1)
+            segments = [(start, end)]
+            length = end - start + 1
+            response_headers['content-type'] = app.video_mimetype(path)
+            if ranges:
+                response_headers['content-range'] = f'bytes {start}-{end}/{stream.size}'
+        response_headers.update({'content-length': length, 'accept-ranges': 'bytes'})
+
+        if scope['method'] == 'HEAD':
+            await respond(send, status, response_headers)
+            return
+        zero_copy = 'http.response.zerocopysend' in scope.get('extensions', {})
+        await stream_file(receive, send, status, response_headers, stream, segments, zero_copy)
+    finally:
+        stream.close()
+
+
+async def stream_file(receive, send, status, headers, stream, segments, zero_copy=False):
+    """Send segments (bytes, or (start, end) ranges of stream) as one body
+
+    Ranges go out with the server's zero-copy send when it offers one,
+    otherwise in pread() chunks. Stops when the client disconnects, or
+    stops reading for STALL_SECONDS (a paused player), so the file is not
+    held open for nothing; the player reconnects with a Range when resumed.
+    """
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def send_body(message):
+        await asyncio.wait_for(send(message), STALL_SECONDS)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.encode(), str(value).encode()) for name, value in headers.items()]})
+        for segment in segments:
+            if disconnected.is_set():
+                return
+            if isinstance(segment, bytes):
+                await send_body({'type': 'http.response.body', 'body': segment, 'more_body': True})
+            elif zero_copy:
+                start, end = segment
+                await send_body({'type': 'http.response.zerocopysend', 'file': stream,
+                                 'offset': start, 'count': end - start + 1, 'more_body': True})
+            else:
+                start, end = segment
+                offset = start
+                while offset <= end and not disconnected.is_set():
+                    chunk = await in_thread(os.pread, stream.fileno(), min(CHUNK_BYTES, end + 1 - offset), offset)
+                    if not chunk:
+                        # File truncated while streaming
+                        break
+                    offset += len(chunk)
+                    # send() waits while the client's socket buffer is full
+                    await send_body({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not disconnected.is_set():
+            await send_body({'type': 'http.response.body', 'body': b''})
+    except asyncio.TimeoutError:
+        print(f"Closing a stalled video stream after {STALL_SECONDS}s")
+    finally:
+        watcher.cancel()
+
+
+# Routes answered here; everything else goes to Flask
+ROUTES = {
+    '/api/browse': browse,
+    '/api/video': video,
+}
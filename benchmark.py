@@ -0,0 +1,437 @@
+"""
+SG Photo Reviewer - Benchmarks
+
+Each measurement runs in a fresh child process so peak RSS belongs to that
+single run. Without --images, synthetic samples are generated in a
+temporary folder.
+
+Usage:
+  python3 benchmark.py jpeg-thumbnails [--images a.jpg b.jpg] [--runs 3]
+  python3 benchmark.py thumbnail-formats [--images a.jpg b.jpg] [--runs 3]
+  python3 benchmark.py progressive-previews [--images a.jpg b.jpg] [--runs 3]
+  python3 benchmark.py raw-profiles --images a.cr3 b.nef [--runs 3]
+  python3 benchmark.py load-test --folder /mnt/fotos --video /mnt/fotos/clip.mov \
+      [--url http://127.0.0.1:5500] [--viewers 8] [--grid-users 8] [--duration 30]
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# Load test: a simulated player reads this many seconds of video per step,
+# keeps at most BUFFER_SECONDS ahead, and stalls when its buffer runs dry
+PLAYER_STEP_SECONDS = 0.25
+PLAYER_BUFFER_SECONDS = 4
+
+# name -> (width, height) of the generated samples
+JPEG_SAMPLES = {
+    '24MP': (6000, 4000),
+    '45MP': (8256, 5504),
+}
+
+
+def make_jpeg_sample(path, size):
+    """Write a noisy JPEG (noise keeps the file realistically large)"""
+    from PIL import Image
+    noise = Image.effect_noise(size, 48)
+    Image.merge('RGB', (noise, noise.rotate(180), noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT))) \
+        .save(path, 'JPEG', quality=92)
+
+
+def sample_images(args, workdir):
+    """Return [(label, path)] of the images to benchmark"""
+    if args.images:
+        return [(os.path.basename(path), path) for path in args.images]
+    samples = []
+    for label, size in JPEG_SAMPLES.items():
+        path = os.path.join(workdir, f'sample_{label}.jpg')
+        print(f"Generating {label} sample ({size[0]}x{size[1]})...", file=sys.stderr)
+        make_jpeg_sample(path, size)
+        samples.append((label, path))
+    return samples
+
+
+def measure(variant, path, *extra):
+    """Run one variant in a child process; returns {'seconds', 'peak_rss_mb', ...}"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '_run', variant, path, *extra],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_variant(variant, path, extra):
+    """Child side of measure(): time one operation and report peak RSS"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from PIL import Image, ImageOps
+    import app
+
+    box = (app.DEFAULT_THUMBNAIL_TIER, app.DEFAULT_THUMBNAIL_TIER)
+    start = time.perf_counter()
+    if variant == 'jpeg-full':
+        # Previous thumbnail path: full-resolution decode, then LANCZOS
+        img = ImageOps.exif_transpose(Image.open(path))
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+    elif variant == 'jpeg-draft':
+        img = app.draft_jpeg(Image.open(path), box)
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+    elif variant.startswith('raw-'):
+        # Sensor demosaic with a RAW render profile (the no-embedded-preview path)
+        import rawpy
+        with rawpy.imread(path) as raw:
+            rgb = raw.postprocess(**app.raw_postprocess_params(variant[len('raw-'):]))
+        img = Image.fromarray(rgb)
+    else:
+        raise SystemExit(f"Unknown variant: {variant}")
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(), 'size': img.size}))
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    # VmHWM belongs to this exec'd image; ru_maxrss can carry the parent's peak over fork
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(rows, columns):
+    """Print rows of dicts as an aligned table"""
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def bench_jpeg_thumbnails(args):
+    """Full decode vs JPEG draft-mode decode for JPG thumbnails"""
+    with tempfile.TemporaryDirectory() as workdir:
+        rows = []
+        for label, path in sample_images(args, workdir):
+            for variant in ('jpeg-full', 'jpeg-draft'):
+                runs = [measure(variant, path) for _ in range(args.runs)]
+                rows.append({
+                    'image': label,
+                    'variant': variant,
+                    'best_ms': round(min(run['seconds'] for run in runs) * 1000, 1),
+                    'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+                })
+        report(rows, ['image', 'variant', 'best_ms', 'peak_rss_mb'])
+
+
+def bench_thumbnail_formats(args):
+    """Encode time and size of every thumbnail tier in each encoding vs JPEG"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from PIL import Image, ImageOps
+    import app
+
+    Image.init()
+    formats = [fmt for fmt, (_, _, options) in app.THUMBNAIL_FORMATS.items()
+               if options['format'] in Image.SAVE]
+    with tempfile.TemporaryDirectory() as workdir:
+        rows = []
+        for label, path in sample_images(args, workdir):
+            box = (max(app.THUMBNAIL_TIERS),) * 2
+            img = ImageOps.exif_transpose(app.draft_jpeg(Image.open(path), box)).convert('RGB')
+            for tier in sorted(app.THUMBNAIL_TIERS, reverse=True):
+                img.thumbnail((tier, tier), Image.Resampling.LANCZOS)
+                jpeg_bytes = None
+                for fmt in formats:
+                    options = app.THUMBNAIL_FORMATS[fmt][2]
+                    timings = []
+                    for _ in range(args.runs):
+                        buffer = io.BytesIO()
+                        start = time.perf_counter()
+                        img.save(buffer, **options)
+                        timings.append(time.perf_counter() - start)
+                    size = buffer.tell()
+                    if fmt == 'jpeg':
+                        jpeg_bytes = size
+                    rows.append({
+                        'image': label,
+                        'tier': tier,
+                        'format': fmt,
+                        'encode_ms': round(min(timings) * 1000, 1),
+                        'kb': round(size / 1024, 1),
+                        'size_vs_jpeg': size,
+                    })
+                for row in rows[-len(formats):]:
+                    row['size_vs_jpeg'] = f"{row['size_vs_jpeg'] / jpeg_bytes:.0%}"
+        report(rows, ['image', 'tier', 'format', 'encode_ms', 'kb', 'size_vs_jpeg'])
+
+
+def first_scan_bytes(data):
+    """Bytes a browser needs before it can paint the whole image once
+
+    For a progressive JPEG that is the end of the first scan (the second SOS
+    marker; 0xFFDA cannot occur inside entropy-coded data). A baseline JPEG
+    paints top to bottom, so it needs the whole file.
+    """
+    first = data.find(b'\xff\xda')
+    second = data.find(b'\xff\xda', first + 2)
+    return second if first >= 0 and second > 0 else len(data)
+
+
+def bench_progressive_previews(args):
+    """Baseline vs progressive JPEG encoding of previews and display copies"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from PIL import Image, ImageOps
+    import app
+
+    variants = {
+        'baseline': {'quality': 90, 'optimize': True},
+        'progressive': {'quality': 90, 'optimize': True, 'progressive': True},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        rows = []
+        for label, path in sample_images(args, workdir):
+            for long_edge in (1920, 2560):
+                img = ImageOps.exif_transpose(app.draft_jpeg(Image.open(path), (long_edge, long_edge)))
+                img.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS)
+                for variant, options in variants.items():
+                    timings = []
+                    for _ in range(args.runs):
+                        buffer = io.BytesIO()
+                        start = time.perf_counter()
+                        img.save(buffer, 'JPEG', **options)
+                        timings.append(time.perf_counter() - start)
+                    data = buffer.getvalue()
+                    rows.append({
+                        'image': label,
+                        'long_edge': long_edge,
+                        'variant': variant,
+                        'encode_ms': round(min(timings) * 1000, 1),
+                        'kb': round(len(data) / 1024, 1),
+                        'first_paint_kb': round(first_scan_bytes(data) / 1024, 1),
+                    })
+        report(rows, ['image', 'long_edge', 'variant', 'encode_ms', 'kb', 'first_paint_kb'])
+
+
+def bench_raw_profiles(args):
+    """Demosaic time and peak memory of each RAW render profile"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    rows = []
+    for path in args.images:
+        for profile in app.RAW_PROFILES:
+            runs = [measure(f'raw-{profile}', path) for _ in range(args.runs)]
+            rows.append({
+                'image': os.path.basename(path),
+                'profile': profile,
+                'output': 'x'.join(str(value) for value in runs[0]['size']),
+                'best_ms': round(min(run['seconds'] for run in runs) * 1000, 1),
+                'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+            })
+    report(rows, ['image', 'profile', 'output', 'best_ms', 'peak_rss_mb'])
+
+
+def percentile(values, share):
+    """Value below which share of the sorted values fall (0 when empty)"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def load_test_grid_user(args, target, photos, deadline, results):
+    """Browse the folder and fetch random thumbnails until the deadline"""
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=120)
+    while time.monotonic() < deadline:
+        if random.random() < 0.2 or not photos:
+            url = '/api/browse?' + urlencode({'path': args.folder})
+        else:
+            photo = random.choice(photos)
+            url = '/api/thumbnail?' + urlencode({'path': photo['display_path'], 'size': 320})
+        start = time.perf_counter()
+        try:
+            conn.request('GET', url)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            ok = False
+        results.append((time.perf_counter() - start, ok))
+
+
+def load_test_viewer(args, target, deadline, results):
+    """Play the video at --bitrate-mbps like a browser, restarting at the end
+
+    Each request asks for the rest of the file from the playback position;
+    the server answers a capped range (video_range_max_mb) and the next
+    request continues after its Content-Range.
+    """
+    step_bytes = int(args.bitrate_mbps * 1e6 / 8 * PLAYER_STEP_SECONDS)
+    url = '/api/video?' + urlencode({'path': args.video})
+    stats = {'ttfb': [], 'stalls': 0, 'bytes': 0, 'errors': 0}
+    started = time.monotonic()
+    offset = 0
+    played = 0.0
+    clock = time.monotonic()
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=120)
+        try:
+            request_start = time.perf_counter()
+            conn.request('GET', url, headers={'Range': f'bytes={offset}-'})
+            response = conn.getresponse()
+            if response.status >= 400:
+                stats['errors'] += 1
+                time.sleep(1)
+                continue
+            stats['ttfb'].append(time.perf_counter() - request_start)
+
+            size = None
+            content_range = response.getheader('Content-Range', '')
+            if response.status == 206 and content_range.startswith('bytes '):
+                size = int(content_range.rpartition('/')[2])
+
+            while time.monotonic() < deadline:
+                data = response.read(step_bytes)
+                if not data:
+                    break
+                offset += len(data)
+                stats['bytes'] += len(data)
+                played += PLAYER_STEP_SECONDS * len(data) / step_bytes
+                ahead = played - (time.monotonic() - clock)
+                if ahead < 0:
+                    # Buffer ran dry: the player pauses and rebuffers
+                    stats['stalls'] += 1
+                    clock = time.monotonic() - played
+                elif ahead > PLAYER_BUFFER_SECONDS:
+                    time.sleep(ahead - PLAYER_BUFFER_SECONDS)
+
+            if size is None or offset >= size:
+                # Played to the end (or got the whole file): start over
+                offset = 0
+        except (OSError, http.client.HTTPException):
+            stats['errors'] += 1
+        finally:
+            conn.close()
+    stats['seconds'] = time.monotonic() - started
+    results.append(stats)
+
+
+def bench_load_test(args):
+    """Concurrent video viewers plus grid users against a running server
+
+    Start the server first (gunicorn for WSGI, uvicorn asgi:application for
+    the ASGI mode) and point --url at it; run it once per mode to compare.
+    Every viewer comes from this machine's address, so the server's
+    video_streams_per_client must be at least --viewers (or 0).
+    """
+    target = urlsplit(args.url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=300)
+    conn.request('GET', '/api/config')
+    streams_per_client = json.loads(conn.getresponse().read()).get('video_streams_per_client', 0)
+    if 0 < streams_per_client < args.viewers:
+        print(f"Warning: the server allows {streams_per_client} video streams per client and all "
+              f"{args.viewers} viewers share this address; the rest get 429. Set "
+              f"video_streams_per_client to {args.viewers} (or 0) in config.json for the test.",
+              file=sys.stderr)
+    conn.request('GET', '/api/scan?' + urlencode({'path': args.folder}))
+    photos = [photo for photo in json.loads(conn.getresponse().read()).get('photos', [])
+              if photo.get('media_type') != 'video']
+    conn.close()
+
+    deadline = time.monotonic() + args.duration
+    grid_results, viewer_results = [], []
+    threads = [threading.Thread(target=load_test_grid_user, args=(args, target, photos, deadline, grid_results))
+               for _ in range(args.grid_users)]
+    threads += [threading.Thread(target=load_test_viewer, args=(args, target, deadline, viewer_results))
+                for _ in range(args.viewers)]
+    print(f"{args.viewers} viewers at {args.bitrate_mbps} Mbit/s + {args.grid_users} grid users "
+          f"for {args.duration}s against {args.url}...", file=sys.stderr)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = [seconds for seconds, ok in grid_results]
+    ttfb = [seconds for stats in viewer_results for seconds in stats['ttfb']]
+    report([
+        {
+            'role': 'grid',
+            'clients': args.grid_users,
+            'requests': len(grid_results),
+            'errors': sum(1 for _, ok in grid_results if not ok),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'stalls': '-',
+            'mbps': '-',
+        },
+        {
+            'role': 'video',
+            'clients': args.viewers,
+            'requests': len(ttfb),
+            'errors': sum(stats['errors'] for stats in viewer_results),
+            'p50_ms': round(percentile(ttfb, 0.5) * 1000, 1),
+            'p95_ms': round(percentile(ttfb, 0.95) * 1000, 1),
+            'stalls': sum(stats['stalls'] for stats in viewer_results),
+            'mbps': round(sum(stats['bytes'] * 8 / 1e6 / stats['seconds'] for stats in viewer_results)
+                          / max(1, len(viewer_results)), 1),
+        },
+    ], ['role', 'clients', 'requests', 'errors', 'p50_ms', 'p95_ms', 'stalls', 'mbps'])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '_run':
+        run_variant(sys.argv[2], sys.argv[3], sys.argv[4:])
+        return
+
+    parser = argparse.ArgumentParser(description='SG Photo Reviewer benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    jpeg = subparsers.add_parser('jpeg-thumbnails', help=bench_jpeg_thumbnails.__doc__)
+    jpeg.add_argument('--images', nargs='+', help='JPG files to use instead of generated samples')
+    jpeg.add_argument('--runs', type=int, default=3)
+    jpeg.set_defaults(func=bench_jpeg_thumbnails)
+
+    formats = subparsers.add_parser('thumbnail-formats', help=bench_thumbnail_formats.__doc__)
+    formats.add_argument('--images', nargs='+', help='JPG files to use instead of generated samples')
+    formats.add_argument('--runs', type=int, default=3)
+    formats.set_defaults(func=bench_thumbnail_formats)
+
+    progressive = subparsers.add_parser('progressive-previews', help=bench_progressive_previews.__doc__)
+    progressive.add_argument('--images', nargs='+', help='JPG files to use instead of generated samples')
+    progressive.add_argument('--runs', type=int, default=3)
+    progressive.set_defaults(func=bench_progressive_previews)
+
+    raw = subparsers.add_parser('raw-profiles', help=bench_raw_profiles.__doc__)
+    raw.add_argument('--images', nargs='+', required=True, help='RAW files (rawpy required)')
+    raw.add_argument('--runs', type=int, default=3)
+    raw.set_defaults(func=bench_raw_profiles)
+
+    load = subparsers.add_parser('load-test', help=bench_load_test.__doc__.splitlines()[0])
+    load.add_argument('--url', default='http://127.0.0.1:5500', help='Running server to test')
+    load.add_argument('--folder', required=True, help='Folder the grid users browse')
+    load.add_argument('--video', required=True, help='Video the viewers play')
+    load.add_argument('--viewers', type=int, default=8)
+    load.add_argument('--grid-users', type=int, default=8)
+    load.add_argument('--duration', type=int, default=30, help='Seconds')
+    load.add_argument('--bitrate-mbps', type=float, default=20, help='Playback bitrate of each viewer')
+    load.set_defaults(func=bench_load_test)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+import json
+import os
+import sqlite3
+import threading
+
+# One connection per thread; gunicorn workers each open their own after fork
+_local = threading.local()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    media_type TEXT,
+    item_type TEXT,
+    paired TEXT,
+    exif TEXT
+);
+CREATE INDEX IF NOT EXISTS media_folder ON media (folder);
+CREATE TABLE IF NOT EXISTS aliases (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS aliases_key ON aliases (key);
+CREATE TABLE IF NOT EXISTS cache_entries (
+    file TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS cache_entries_key ON cache_entries (key);
+CREATE INDEX IF NOT EXISTS cache_entries_access ON cache_entries (last_access);
+CREATE TABLE IF NOT EXISTS render_jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    batch_time REAL NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL,
+    arg TEXT NOT NULL DEFAULT '',
+    UNIQUE (kind, path)
+);
+CREATE INDEX IF NOT EXISTS render_jobs_queue ON render_jobs (status, batch_time DESC, position);
+CREATE INDEX IF NOT EXISTS render_jobs_folder ON render_jobs (folder, kind);
+CREATE TABLE IF NOT EXISTS render_sources (
+    ext TEXT NOT NULL,
+    source TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ext, source)
+);
+'''
+
+
+def get_connection(db_path):
+    """Return this thread's connection to the catalog, creating the schema once"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        # WAL lets every worker read while one of them writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _add_missing_columns(conn)
+        connections[db_path] = conn
+    return conn
+
+
+def _add_missing_columns(conn):
+    """Bring tables created by older versions up to date"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(render_jobs)')}
+    if 'arg' not in columns:
+        try:
+            conn.execute("ALTER TABLE render_jobs ADD COLUMN arg TEXT NOT NULL DEFAULT ''")
+        except sqlite3.OperationalError:
+            # Another worker added it first
+            pass
+
+
+def load_folder(db_path, folder):
+    """Return cached metadata for a folder as {path: (size, mtime_ns, exif)}"""
+    conn = get_connection(db_path)
+    rows = conn.execute(
+        'SELECT path, size, mtime_ns, exif FROM media WHERE folder = ?', (folder,)
+    )
+    return {path: (size, mtime_ns, json.loads(exif) if exif else {})
+            for path, size, mtime_ns, exif in rows}
+
+
+def store_folder(db_path, folder, entries, keep_paths):
+    """Upsert catalog rows for a folder and drop rows of files no longer present
+
+    entries: iterable of dicts with path, size, mtime_ns, media_type, item_type,
+    paired and exif keys.
+    keep_paths: every metadata source path that still exists in the folder.
+    """
+    conn = get_connection(db_path)
+    keep_paths = set(keep_paths)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(
+            'INSERT OR REPLACE INTO media '
+            '(path, folder, size, mtime_ns, media_type, item_type, paired, exif) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(e['path'], folder, e['size'], e['mtime_ns'], e['media_type'],
+              e['item_type'], e['paired'], json.dumps(e['exif'])) for e in entries]
+        )
+        stale = [(path,) for (path,) in
+                 conn.execute('SELECT path FROM media WHERE folder = ?', (folder,))
+                 if path not in keep_paths]
+        conn.executemany('DELETE FROM media WHERE path = ?', stale)
+
+
+def record_render_source(db_path, ext, source):
+    """Count which path (embedded preview, rawpy thumbnail, demosaic) rendered a file"""
+    conn = get_connection(db_path)
+    conn.execute(
+        'INSERT INTO render_sources (ext, source, count) VALUES (?, ?, 1) '
+        'ON CONFLICT (ext, source) DO UPDATE SET count = count + 1',
+        (ext, source)
+    )
+
+
+def render_source_stats(db_path):
+    """Return {ext: {source: count}} for every recorded render"""
+    conn = get_connection(db_path)
+    stats = {}
+    for ext, source, count in conn.execute('SELECT ext, source, count FROM render_sources'):
+        stats.setdefault(ext, {})[source] = count
+    return stats
+
+
+def get_alias(db_path, path):
+    """Return (size, mtime_ns, key) cached for a path or None"""
+    conn = get_connection(db_path)
+    return conn.execute(
+        'SELECT size, mtime_ns, key FROM aliases WHERE path = ?', (path,)
+    ).fetchone()
+
+
+def set_alias(db_path, path, size, mtime_ns, key):
+    """Remember which cache key a path's current content maps to"""
+    conn = get_connection(db_path)
+    conn.execute(
+        'INSERT OR REPLACE INTO aliases (path, size, mtime_ns, key) VALUES (?, ?, ?, ?)',
+        (path, size, mtime_ns, key)
+    )
+
+
+def move_alias(db_path, old_path, new_path):
+    """Point a renamed file's new path at its existing cache key"""
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM aliases WHERE path = ?', (new_path,))
+        conn.execute('UPDATE aliases SET path = ? WHERE path = ?', (new_path, old_path))
+
+
+def delete_alias(db_path, path):
+    """Forget the cache key of a deleted file"""
+    conn = get_connection(db_path)
+    conn.execute('DELETE FROM aliases WHERE path = ?', (path,))
+
+
+def alias_paths(db_path, key):
+    """Return every source path currently mapped to a cache key"""
+    conn = get_connection(db_path)
+    return [path for (path,) in conn.execute('SELECT path FROM aliases WHERE key = ?', (key,))]
+
+
+def add_cache_entry(db_path, file, key, size, now):
+    """Track a file written to the render cache (file is relative to the cache dir)"""
+    conn = get_connection(db_path)
+    conn.execute(
+        'INSERT OR REPLACE INTO cache_entries (file, key, bytes, last_access, hits) '
+        'VALUES (?, ?, ?, ?, 0)',
+        (file, key, size, now)
+    )
+
+
+def touch_cache_entries(db_path, touches):
+    """Apply buffered accesses: touches is {file: (hits, last_access)}"""
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(
+            'UPDATE cache_entries SET hits = hits + ?, last_access = MAX(last_access, ?) '
+            'WHERE file = ?',
+            [(hits, last_access, file) for file, (hits, last_access) in touches.items()]
+        )
+
+
+def cache_totals(db_path):
+    """Return (entries, bytes, hits, oldest_access) of the render cache"""
+    conn = get_connection(db_path)
+    count, total, hits, oldest = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(bytes), 0), COALESCE(SUM(hits), 0), MIN(last_access) '
+        'FROM cache_entries'
+    ).fetchone()
+    return count, total, hits, oldest
+
+
+def eviction_candidates(db_path, policy, limit):
+    """Return up to limit (file, bytes) rows, first to evict first"""
+    conn = get_connection(db_path)
+    if policy == 'lfu':
+        order = 'hits ASC, last_access ASC'
+    else:
+        order = 'last_access ASC'
+    return conn.execute(
+        f'SELECT file, bytes FROM cache_entries ORDER BY {order} LIMIT ?', (limit,)
+    ).fetchall()
+
+
+def cache_entries(db_path):
+    """Return {file: key} for every tracked cache file"""
+    conn = get_connection(db_path)
+    return dict(conn.execute('SELECT file, key FROM cache_entries'))
+
+
+def cache_files_for_key(db_path, key):
+    """Return the tracked cache files rendered from one source key"""
+    conn = get_connection(db_path)
+    return [file for (file,) in conn.execute('SELECT file FROM cache_entries WHERE key = ?', (key,))]
+
+
+def rename_cache_entry(db_path, old_file, new_file):
+    """Follow a cache file moved inside the cache directory"""
+    conn = get_connection(db_path)
+    conn.execute('UPDATE cache_entries SET file = ? WHERE file = ?', (new_file, old_file))
+
+
+def delete_cache_entries(db_path, files):
+    """Stop tracking cache files"""
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('DELETE FROM cache_entries WHERE file = ?', [(file,) for file in files])
+
+
+def delete_aliases_for_key(db_path, key):
+    """Forget every path mapped to a key"""
+    conn = get_connection(db_path)
+    conn.execute('DELETE FROM aliases WHERE key = ?', (key,))
+
+
+def enqueue_jobs(db_path, kind, folder, paths, now, keep_seconds, arg=''):
+    """Queue one job per path, ordered by position; newer batches run first
+
+    Replaces queued and failed jobs of the same kind and folder (stale work
+    is cancelled) and drops finished jobs older than keep_seconds. Jobs
+    already running, and done jobs for a path still in paths with the same
+    arg, are left alone, so reopening a rendered folder queues nothing.
+    arg is passed to every job's handler.
+    """
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            "DELETE FROM render_jobs WHERE status IN ('done', 'failed') AND updated < ?",
+            (now - keep_seconds,)
+        )
+        conn.execute(
+            "DELETE FROM render_jobs WHERE kind = ? AND folder = ? "
+            "AND status != 'running' AND NOT (status = 'done' AND arg = ?)",
+            (kind, folder, arg)
+        )
+        wanted = set(paths)
+        conn.executemany(
+            "DELETE FROM render_jobs WHERE kind = ? AND path = ? AND status = 'done'",
+            [(kind, path) for (path,) in conn.execute(
+                "SELECT path FROM render_jobs WHERE kind = ? AND folder = ? AND status = 'done'",
+                (kind, folder)
+            ) if path not in wanted]
+        )
+        conn.executemany(
+            'INSERT OR IGNORE INTO render_jobs '
+            '(kind, path, folder, batch_time, position, status, updated, arg) '
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            [(kind, path, folder, now, position, now, arg) for position, path in enumerate(paths)]
+        )
+
+
+def claim_job(db_path, now, stale_seconds):
+    """Mark the most urgent queued job as running and return (id, kind, path, arg)
+
+    Jobs left running longer than stale_seconds (their worker died) are
+    queued again first. Returns None when the queue is empty.
+    """
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            "UPDATE render_jobs SET status = 'queued' WHERE status = 'running' AND updated < ?",
+            (now - stale_seconds,)
+        )
+        job = conn.execute(
+            "SELECT id, kind, path, arg FROM render_jobs WHERE status = 'queued' "
+            'ORDER BY batch_time DESC, position ASC LIMIT 1'
+        ).fetchone()
+        if job:
+            conn.execute(
+                "UPDATE render_jobs SET status = 'running', updated = ? WHERE id = ?", (now, job[0])
+            )
+        return job
+
+
+def finish_job(db_path, job_id, status, now):
+    """Record the outcome ('done' or 'failed') of a job"""
+    conn = get_connection(db_path)
+    conn.execute('UPDATE render_jobs SET status = ?, updated = ? WHERE id = ?', (status, now, job_id))
+
+
+def job_progress(db_path, kind, folder):
+    """Return {status: count} of a folder's jobs"""
+    conn = get_connection(db_path)
+    return dict(conn.execute(
+        'SELECT status, COUNT(*) FROM render_jobs WHERE kind = ? AND folder = ? GROUP BY status',
+        (kind, folder)
+    ))
@@ -6,7 +6,50 @@ CONFIG_FILE = 'config.json'
 DEFAULT_CONFIG = {
     'mount_points': ['/mnt/nvme', '/data1'],
     'destination_folder': 'para-revision',
-    'enable_delete_button': False
+    'enable_delete_button': False,
+    # SQLite metadata catalog shared by all gunicorn workers
+    'catalog_path': 'catalog.db',
+    # Processes per web worker used to extract EXIF during scans (1 = serial)
+    'scan_workers': 4,
+    # Seconds a single file may take before its metadata is skipped
+    'exif_timeout': 20,
+    # Byte budget of static/thumbnails and eviction policy ('lru' or 'lfu')
+    'thumbnail_cache_max_mb': 2048,
+    'thumbnail_cache_policy': 'lru',
+    # Thumbnail encodings in order of preference, negotiated via Accept ('avif', 'webp', 'jpeg')
+    'thumbnail_formats': ['webp', 'jpeg'],
+    # Long edge in px of the cached display previews of RAW files
+    'raw_preview_long_edge': 2560,
+    # rawpy render profile when a RAW has no usable embedded preview: 'quick'
+    # (half-size, LINEAR demosaic) or 'full'; full resolution mode always uses 'full'
+    'raw_render_profile': 'quick',
+    # Encode RAW previews and resized display copies as progressive JPEGs
+    'progressive_previews': True,
+    # Render every thumbnail of a folder in the background when it is opened
+    'pregenerate_thumbnails': True,
+    # Low-priority background render threads per web worker
+    'pregenerate_workers': 1,
+    # RAW demosaics running at once across all workers (background renders leave one free)
+    'raw_decode_slots': 2,
+    # Estimated memory concurrent RAW demosaics may use together, in MB
+    'raw_decode_memory_mb': 1536,
+    # Seconds a request waits for a decode slot, or in the decode service's
+    # queue, before getting 503 + Retry-After
+    'raw_decode_wait': 15,
+    # Unix socket of the decode service (decoder.py); web workers decode
+    # in-process when it is empty or nothing listens on it
+    'decoder_socket': 'decoder.sock',
+    # Decoder processes of the decode service for requests; background renders
+    # get their own low-priority pool with one fewer (at least one)
+    'decoder_workers': 2,
+    # Seconds a web worker waits for the decode service to answer (kept below
+    # the 120 s render lock timeout; 503 + Retry-After past it)
+    'decoder_timeout': 300,
+    # Longest answer to a video byte range in MB; players request the rest (0 = no limit)
+    'video_range_max_mb': 16,
+    # Video streams one client address may have open at once across all workers
+    # (0 = no limit); clients behind a reverse proxy or NAT share it
+    'video_streams_per_client': 4
 }
 
 def load_config():
@@ -14,7 +57,8 @@ def load_config():
     if os.path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
+                # Keys missing from older config files fall back to defaults
+                return {**DEFAULT_CONFIG, **json.load(f)}
         except Exception as e:
             print(f"Error loading config: {e}")
             return DEFAULT_CONFIG.copy()
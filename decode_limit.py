@@ -0,0 +1,91 @@
+"""
+Cross-worker admission control for memory-hungry decodes (RAW demosaic)
+
+All gunicorn workers share a directory of slot files. A running decode
+holds an exclusive flock() on one slot and writes the bytes it expects to
+use into it; the lock goes away with the process, so a killed worker never
+leaks a slot. Admission happens under a short global lock: a decode gets in
+when a slot is free and its estimate fits the memory budget next to the
+decodes already running (a decode running alone is always admitted, however
+large). Callers wait up to a timeout and then get DecoderBusy, which the
+web app turns into 503 + Retry-After instead of pushing the box into swap.
+"""
+
+import contextlib
+import fcntl
+import os
+import time
+
+# Seconds between admission attempts while waiting
+POLL_SECONDS = 0.1
+
+
+class DecoderBusy(Exception):
+    """No decode slot or memory became available in time"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Decoder busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Travels back from the decode service (decoder.py) pickled
+        return DecoderBusy, (self.retry_after,)
+
+
+@contextlib.contextmanager
+def admit(lock_dir, slots, budget_bytes, needed_bytes, timeout, reserved_slots=0):
+    """Hold one of slots decode slots while the with-block runs
+
+    reserved_slots are left for other callers (background work passes 1 so
+    an interactive request can always get in). Raises DecoderBusy after
+    waiting timeout seconds.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        slot = _try_admit(lock_dir, slots, budget_bytes, needed_bytes, reserved_slots)
+        if slot:
+            break
+        if time.monotonic() >= deadline:
+            raise DecoderBusy(max(1, round(timeout / 4)))
+        time.sleep(POLL_SECONDS)
+
+    try:
+        yield
+    finally:
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+
+def _try_admit(lock_dir, slots, budget_bytes, needed_bytes, reserved_slots):
+    """Take a free slot if the budget allows; returns its locked file or None"""
+    with open(os.path.join(lock_dir, 'admission.lock'), 'a') as admission:
+        fcntl.flock(admission, fcntl.LOCK_EX)
+
+        free = []
+        busy = 0
+        used_bytes = 0
+        for i in range(slots):
+            slot = open(os.path.join(lock_dir, f'slot-{i}'), 'a+b')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Holders only write their reservation under the admission lock
+                slot.seek(0)
+                used_bytes += int(slot.read() or 0)
+                busy += 1
+                slot.close()
+                continue
+            free.append(slot)
+
+        chosen = None
+        if len(free) > reserved_slots and (busy == 0 or used_bytes + needed_bytes <= budget_bytes):
+            chosen = free.pop(0)
+            chosen.truncate(0)
+            chosen.write(str(needed_bytes).encode())
+            chosen.flush()
+
+        for slot in free:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+        return chosen
@@ -0,0 +1,195 @@
+"""
+SG Photo Reviewer - Decode service
+
+Runs the heavy render steps (RAW demosaic, JPEG and video decoding,
+resizing, encoding; app.RENDER_TASKS) in a pool of processes separate from
+the web workers. Web workers keep the cache lookups and single-flight locks
+and only send cache misses here, over a Unix socket, so a burst of RAW
+decodes occupies decoder processes instead of the workers serving
+/api/browse or /api/config.
+
+Requests and background renders (jobs.py) get separate pools, so queued
+background work never delays a request; background processes run niced.
+
+Start it from the application directory, next to gunicorn:
+    python3 decoder.py
+When nothing listens on decoder_socket the web workers decode in-process.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from decode_limit import DecoderBusy
+
+# Process pool per kind of work: False for requests, True for background renders
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+class DecoderUnavailable(Exception):
+    """No decode service listens on the socket"""
+
+
+def call(socket_path, task, args, background=False, timeout=None, max_wait=None):
+    """Run a render task in the decode service and return its result
+
+    Exceptions raised by the task are raised here, and DecoderBusy when the
+    task waited more than max_wait seconds for a decoder process. Raises
+    DecoderUnavailable when the service is not running, TimeoutError after
+    timeout seconds.
+    """
+    try:
+        conn = Client(socket_path, family='AF_UNIX')
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        raise DecoderUnavailable(str(e))
+
+    with conn:
+        conn.send((task, args, background, max_wait))
+        if not conn.poll(timeout):
+            raise TimeoutError(f"Decode service did not finish {task} within {timeout}s")
+        ok, result = conn.recv()
+    if not ok:
+        raise result
+    return result
+
+
+def _run(task, args, background, queued, max_wait):
+    """Pool side: run one task as app would in-process"""
+    import app
+    import jobs
+    # CLOCK_MONOTONIC is shared by every process of the machine
+    if max_wait and time.monotonic() - queued > max_wait:
+        # The client is better off retrying than waiting behind this queue
+        raise DecoderBusy(max(1, round(max_wait / 4)))
+    # Background renders leave a RAW decode slot for requests (see decode_limit)
+    jobs.set_background(background)
+    return app.RENDER_TASKS[task](*args)
+
+
+def pool_size(workers, background):
+    """Decoder processes of a pool: workers for requests, one fewer (at
+    least one) for background renders"""
+    return max(1, workers - 1) if background else workers
+
+
+def _lower_priority():
+    """Initializer of background decoder processes: yield the CPU to requests"""
+    import jobs
+    try:
+        os.nice(jobs.BACKGROUND_NICE)
+    except OSError:
+        pass
+
+
+def _new_pool(workers, background):
+    context = multiprocessing.get_context('forkserver')
+    # Decoder processes fork from a server that has the app imported already
+    context.set_forkserver_preload(['app'])
+    return concurrent.futures.ProcessPoolExecutor(
+        pool_size(workers, background), mp_context=context,
+        initializer=_lower_priority if background else None
+    )
+
+
+def _submit(task, args, background, max_wait, workers):
+    """Run a task in its pool, replacing the pool if a decoder process died"""
+    with _pool_lock:
+        pool = _pools[background]
+    try:
+        return pool.submit(_run, task, args, background, time.monotonic(), max_wait).result()
+    except concurrent.futures.process.BrokenProcessPool:
+        with _pool_lock:
+            if _pools[background] is pool:
+                print("A decoder process died (out of memory?), restarting the pool")
+                _pools[background] = _new_pool(workers, background)
+        raise RuntimeError(f"Decoder process died while running {task}")
+
+
+def _handle(conn, workers):
+    """Answer one request: (task, args, background, max_wait) -> (ok, result or exception)"""
+    with conn:
+        try:
+            task, args, background, max_wait = conn.recv()
+        except (EOFError, OSError, ValueError):
+            return
+        try:
+            reply = (True, _submit(task, args, bool(background), max_wait, workers))
+        except Exception as e:
+            reply = (False, e)
+
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            # The web worker gave up waiting
+            pass
+        except Exception:
+            # Exceptions that do not pickle go back as plain errors
+            conn.send((False, RuntimeError(str(reply[1]))))
+
+
+def is_listening(socket_path):
+    """True when a decode service already answers on socket_path"""
+    probe = socket.socket(socket.AF_UNIX)
+    try:
+        probe.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def serve(socket_path, workers):
+    """Accept render requests on socket_path until killed"""
+    if is_listening(socket_path):
+        sys.exit(f"A decode service is already running on {socket_path}")
+    if os.path.exists(socket_path):
+        # Left behind by a service that did not shut down cleanly
+        os.unlink(socket_path)
+
+    for background in (False, True):
+        _pools[background] = _new_pool(workers, background)
+    # Only this user may connect: requests are unpickled
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(socket_path, family='AF_UNIX')
+    finally:
+        os.umask(old_umask)
+
+    # systemctl stop: leave the loop so the pool and socket are cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Decode service listening on {socket_path} with {pool_size(workers, False)} decoder "
+          f"processes for requests and {pool_size(workers, True)} for background renders")
+    try:
+        with listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    print(f"Error accepting decode request: {e}")
+                    continue
+                threading.Thread(target=_handle, args=(conn, workers), daemon=True).start()
+    finally:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from config import load_config
+
+    config = load_config()
+    if not config['decoder_socket']:
+        sys.exit("decoder_socket is empty in config.json; web workers decode in-process")
+    serve(config['decoder_socket'], max(1, config['decoder_workers']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Background render queue
+
+Jobs live in the catalog's render_jobs table, so every gunicorn worker can
+pick them up and progress is visible from any of them. Each web worker runs
+a few low-priority daemon threads that claim the most urgent job (most
+recently opened folder first, then grid position) and hand it to the
+handler registered for its kind. On-demand requests never wait in this
+queue: they render directly, and the single-flight lock makes them share
+the work with a background thread already on the same file.
+"""
+
+import os
+import threading
+import time
+
+import catalog
+from decode_limit import DecoderBusy
+
+# Seconds an idle worker thread sleeps before polling the queue again
+IDLE_POLL_SECONDS = 2
+# A running job not finished after this long is assumed lost and requeued
+STALE_SECONDS = 600
+# Finished jobs are kept this long for progress reporting
+KEEP_SECONDS = 24 * 3600
+# Nice increment of background threads so they yield to request handling
+BACKGROUND_NICE = 10
+
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+# Marks worker threads, see in_background()
+_local = threading.local()
+
+
+def enqueue(db_path, kind, folder, paths, arg=''):
+    """Queue paths (most urgent first) for background rendering
+
+    Queued jobs of the same kind and folder that are not in paths any more
+    are cancelled; paths already done are not queued again.
+    """
+    catalog.enqueue_jobs(db_path, kind, folder, paths, time.time(), KEEP_SECONDS, arg)
+    _wakeup.set()
+
+
+def progress(db_path, kind, folder):
+    """Counts of a folder's jobs by status, plus total and completed"""
+    counts = catalog.job_progress(db_path, kind, folder)
+    result = {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+    result['total'] = sum(counts.values())
+    result['completed'] = result['done'] + result['failed']
+    return result
+
+
+def in_background():
+    """True when called from a render worker thread rather than a request"""
+    return getattr(_local, 'background', False)
+
+
+def set_background(background):
+    """Mark this thread as doing background work (or not) for in_background()"""
+    _local.background = background
+
+
+def start_workers(db_path, handlers, count):
+    """Start count worker threads in this process (once)
+
+    handlers maps job kind -> callable(path, arg) returning a truthy value on success.
+    """
+    global _started
+    with _start_lock:
+        if _started or count <= 0:
+            return
+        _started = True
+
+    for i in range(count):
+        threading.Thread(target=_worker_loop, args=(db_path, handlers),
+                         name=f'render-worker-{i}', daemon=True).start()
+
+
+def _worker_loop(db_path, handlers):
+    set_background(True)
+    try:
+        # Linux applies PRIO_PROCESS to single threads when given a thread id
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), BACKGROUND_NICE)
+    except (AttributeError, OSError):
+        pass
+
+    while True:
+        try:
+            job = catalog.claim_job(db_path, time.time(), STALE_SECONDS)
+        except Exception as e:
+            print(f"Error claiming render job: {e}")
+            job = None
+
+        if not job:
+            _wakeup.wait(IDLE_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+
+        job_id, kind, path, arg = job
+        status = 'failed'
+        try:
+            handler = handlers.get(kind)
+            if handler and handler(path, arg):
+                status = 'done'
+        except DecoderBusy:
+            # Requests are using the RAW decoders; try again later
+            status = 'queued'
+        except Exception as e:
+            print(f"Error running {kind} job for {path}: {e}")
+
+        try:
+            catalog.finish_job(db_path, job_id, status, time.time())
+        except Exception as e:
+            print(f"Error finishing render job {job_id}: {e}")
@@ -0,0 +1,331 @@
+import collections
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+import time
+
+# RAW file extensions
+RAW_EXTENSIONS = {'.cr2', '.cr3', '.arw', '.nef', '.pef', '.dng', '.raf', '.orf'}
+JPG_EXTENSIONS = {'.jpg', '.jpeg'}
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.avi', '.m4v'}
+
+# Fields filled from EXIF for every scan entry
+EXIF_FIELDS = ('camera_brand', 'camera_model', 'iso', 'aperture', 'shutter_speed', 'date')
+
+# Seconds between checks for files past their extraction deadline
+POLL_SECONDS = 0.1
+
+# Metadata extraction processes shared by the scans of a web worker (created lazily)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def file_version(size, mtime_ns):
+    """Version token of a file's content; changes whenever size or mtime do"""
+    return f'{size:x}-{mtime_ns:x}'
+
+
+def _new_item(name, path, item_type, media_type, size, version, jpg=None, raw=None):
+    """Build a scan entry with empty EXIF fields
+
+    version identifies the displayed file's current content (see file_version).
+    """
+    item = {
+        'jpg': jpg,
+        'raw': raw,
+        'name': name,
+        'type': item_type,
+        'media_type': media_type,
+        'camera_brand': '',
+        'camera_model': '',
+        'iso': None,
+        'aperture': None,
+        'shutter_speed': None,
+        'date': '',
+        'size': size,
+        'display_path': path,
+        'version': version
+    }
+    if media_type == 'video':
+        item['video'] = path
+    return item
+
+
+def index_directory(path):
+    """List a folder exactly once and index media files by lowercase stem
+
+    Returns dict: stem -> {'jpg': [...], 'raw': [...], 'video': [...]}, each a
+    list of (name, path, size, mtime_ns) tuples sorted by name.
+    """
+    index = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                if ext in JPG_EXTENSIONS:
+                    kind = 'jpg'
+                elif ext in RAW_EXTENSIONS:
+                    kind = 'raw'
+                elif ext in VIDEO_EXTENSIONS:
+                    kind = 'video'
+                else:
+                    continue
+                bucket = index.setdefault(stem.lower(), {'jpg': [], 'raw': [], 'video': []})
+                stat = entry.stat()
+                bucket[kind].append((entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+            except OSError as e:
+                print(f"Error processing {entry.name}: {e}")
+                continue
+
+    for bucket in index.values():
+        for files in bucket.values():
+            files.sort()
+    return index
+
+
+def list_media(path):
+    """Classify the files of a folder from a single directory listing
+
+    Returns a list of (item, exif_source) tuples sorted by file name. item has
+    the /api/scan entry shape with empty EXIF fields; exif_source is the file
+    EXIF should be read from as a (path, size, mtime_ns) signature (the RAW
+    when paired, None for videos).
+    """
+    jpgs, orphan_raws, videos = [], [], []
+
+    for bucket in index_directory(path).values():
+        # Rule: a JPG pairs with the first RAW sharing its stem; other RAWs are orphans
+        paired_raw = bucket['raw'][0] if bucket['jpg'] and bucket['raw'] else None
+
+        for name, jpg_path, size, mtime_ns in bucket['jpg']:
+            if paired_raw:
+                item = _new_item(name, jpg_path, 'jpg+raw', 'image', size + paired_raw[2],
+                                 file_version(size, mtime_ns), jpg=jpg_path, raw=paired_raw[1])
+                jpgs.append((item, paired_raw[1:]))
+            else:
+                item = _new_item(name, jpg_path, 'jpg_only', 'image', size,
+                                 file_version(size, mtime_ns), jpg=jpg_path)
+                jpgs.append((item, (jpg_path, size, mtime_ns)))
+
+        for raw_file in bucket['raw']:
+            if raw_file is paired_raw:
+                continue
+            name, raw_path, size, mtime_ns = raw_file
+            item = _new_item(name, raw_path, 'raw_only', 'image', size,
+                             file_version(size, mtime_ns), raw=raw_path)
+            orphan_raws.append((item, raw_file[1:]))
+
+        for name, video_path, size, mtime_ns in bucket['video']:
+            videos.append((_new_item(name, video_path, 'video', 'video', size,
+                                     file_version(size, mtime_ns)), None))
+
+    # Sort by filename (stable, so JPGs stay ahead of RAWs and videos on ties)
+    media = jpgs + orphan_raws + videos
+    media.sort(key=lambda pair: pair[0]['name'].lower())
+    return media
+
+
+def find_stale_sources(media, cached):
+    """Return {source_path: (item, exif_source)} for files missing from or
+    changed since the catalog snapshot cached ({path: (size, mtime_ns, exif)})
+    """
+    stale = {}
+    for item, exif_source in media:
+        if not exif_source:
+            continue
+        entry = cached.get(exif_source[0])
+        if not entry or entry[:2] != exif_source[1:]:
+            stale.setdefault(exif_source[0], (item, exif_source))
+    return stale
+
+
+def catalog_entry(item, exif_source, exif_data):
+    """Build the catalog row for a scan entry's metadata source"""
+    source_path, size, mtime_ns = exif_source
+    return {
+        'path': source_path,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'media_type': item['media_type'],
+        'item_type': item['type'],
+        'paired': item['jpg'] if source_path == item['raw'] else item['raw'],
+        'exif': exif_data
+    }
+
+
+def apply_exif(item, exif_data):
+    """Copy extracted EXIF values into a scan entry"""
+    for field in EXIF_FIELDS:
+        value = exif_data.get(field)
+        if value is not None:
+            item[field] = value
+    return item
+
+
+def _extraction_process(conn):
+    """Extraction process: answer (extractor, path) requests until the pipe closes"""
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        extractor, path = request
+        try:
+            reply = (True, extractor(path))
+        except Exception as e:
+            reply = (False, str(e))
+        conn.send(reply)
+
+
+class _Extractor:
+    """One extraction process and the file it is working on"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_extraction_process, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.deadline = 0
+
+    def start(self, task):
+        extractor, path, timeout, finished, cancelled = task
+        self.conn.send((extractor, path))
+        self.task = task
+        self.deadline = time.monotonic() + timeout
+
+    def finish(self, result):
+        finished, path = self.task[3], self.task[1]
+        self.task = None
+        finished.put((path, result))
+
+    def stop(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join(1)
+
+
+class _ExtractionPool:
+    """Extraction processes shared by every scan of a web worker
+
+    They start from a forkserver, not forked from the threaded web worker,
+    so none inherits a lock another thread held. A dispatcher thread hands
+    queued files to idle processes in submission order and knows which
+    process works on which file, so a process past its file's deadline is
+    killed and replaced without disturbing the others.
+    """
+
+    def __init__(self):
+        self.context = multiprocessing.get_context('forkserver')
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.size = 1
+        self.extractors = []
+        threading.Thread(target=self._dispatch, name='exif-dispatcher', daemon=True).start()
+
+    def submit(self, tasks, workers):
+        """Queue (extractor, path, timeout, finished, cancelled) tasks"""
+        with self.lock:
+            self.size = max(1, workers)
+            self.pending.extend(tasks)
+
+    def _dispatch(self):
+        while True:
+            try:
+                self._step()
+            except Exception as e:
+                print(f"Error dispatching metadata extraction: {e}")
+                time.sleep(POLL_SECONDS)
+
+    def _step(self):
+        with self.lock:
+            # Follow scan_workers: add processes, retire idle surplus ones
+            while len(self.extractors) < self.size:
+                self.extractors.append(_Extractor(self.context))
+            for extractor in [e for e in self.extractors if not e.task][:len(self.extractors) - self.size]:
+                self._remove(extractor)
+
+            for extractor in list(self.extractors):
+                while not extractor.task and self.pending:
+                    task = self.pending.popleft()
+                    if task[4].is_set():
+                        # The scan went away
+                        continue
+                    try:
+                        extractor.start(task)
+                    except OSError:
+                        self.pending.appendleft(task)
+                        self._remove(extractor)
+                        break
+            busy = {extractor.conn: extractor for extractor in self.extractors if extractor.task}
+
+        if not busy:
+            time.sleep(POLL_SECONDS)
+            return
+        for conn in multiprocessing.connection.wait(list(busy), POLL_SECONDS):
+            extractor = busy[conn]
+            try:
+                ok, result = conn.recv()
+            except (EOFError, OSError):
+                ok, result = False, 'extraction process died'
+                with self.lock:
+                    self._remove(extractor)
+            if not ok:
+                print(f"Error extracting metadata from {extractor.task[1]}: {result}")
+                result = None
+            extractor.finish(result)
+
+        now = time.monotonic()
+        for extractor in busy.values():
+            if extractor.task and now >= extractor.deadline:
+                print(f"Timed out extracting metadata from {extractor.task[1]}")
+                with self.lock:
+                    self._remove(extractor)
+                extractor.finish(None)
+
+    def _remove(self, extractor):
+        """Stop a process (idle, dead or stuck); the next step starts a replacement if needed"""
+        self.extractors.remove(extractor)
+        extractor.stop()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _ExtractionPool()
+        return _pool
+
+
+def iter_extract(extractor, paths, workers, timeout):
+    """Run extractor on every path in this web worker's extraction processes
+
+    Yields (path, result) pairs as files finish. A file that raises, or does
+    not finish within timeout seconds of starting, yields None (nothing to
+    store: the next scan retries it) and only the process stuck on it is
+    replaced, so one corrupted file cannot stall this scan or scans running
+    in other threads.
+    """
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return
+
+    finished = queue.Queue()
+    cancelled = threading.Event()
+    _get_pool().submit([(extractor, path, timeout, finished, cancelled) for path in paths], workers)
+    try:
+        for _ in paths:
+            yield finished.get()
+    finally:
+        # Files of an abandoned scan that have not started are skipped
+        cancelled.set()
+
+
+def extract_all(extractor, paths, workers, timeout):
+    """Run extractor on every path in the pool and return {path: result or None}"""
+    return dict(iter_extract(extractor, paths, workers, timeout))
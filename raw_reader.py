@@ -0,0 +1,432 @@
+"""
+Lightweight RAW header reader
+
+Reads camera metadata and embedded JPEG previews straight from the TIFF/EXIF
+structures of RAW files without running the LibRaw decoder. CR2, ARW, NEF,
+PEF, DNG and ORF are TIFF based; CR3 stores its TIFF blocks and preview inside
+ISO BMFF boxes and RAF wraps a JPEG whose APP1 segment holds the EXIF.
+"""
+
+import datetime
+import os
+import struct
+
+# Bytes read up front; metadata of every supported format sits well inside
+HEAD_BYTES = 512 * 1024
+
+# TIFF tags
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_NEW_SUBFILE_TYPE = 0x00FE
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_ORIENTATION = 0x0112
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TAG_EXIF_IFD = 0x8769
+TAG_EXPOSURE_TIME = 0x829A
+TAG_FNUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_DATETIME_ORIGINAL = 0x9003
+
+# Field type -> (struct format, size)
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('LL', 8),
+    6: ('b', 1), 7: ('s', 1), 8: ('h', 2), 9: ('l', 4), 10: ('ll', 8),
+}
+
+# CR3: uuid box inside moov holding the CMT1..CMT4 TIFF blocks
+CR3_METADATA_UUID = bytes.fromhex('85c0b687820f11e08111f4ce462b6a48')
+# CR3: top level uuid box holding the PRVW JPEG preview
+CR3_PREVIEW_UUID = bytes.fromhex('eaf42b5e1c984b88b9fbb7dc406e4d16')
+
+# JPEG start-of-frame markers Pillow can decode (baseline, extended, progressive);
+# lossless SOF3 streams hold sensor data, not previews
+DISPLAYABLE_SOF = {0xFFC0, 0xFFC1, 0xFFC2}
+
+
+class RawReader:
+    """Random access over a RAW file, served from the header buffer when possible"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = os.fstat(f.fileno()).st_size
+        self.head = f.read(HEAD_BYTES)
+
+    def read(self, offset, length):
+        if offset + length <= len(self.head):
+            return self.head[offset:offset + length]
+        self.f.seek(offset)
+        return self.f.read(length)
+
+
+def parse_ifd(reader, base, offset, endian):
+    """Parse one IFD of a TIFF block starting at base
+
+    Returns ({tag: value}, next_ifd_offset). Values are ints, tuples of ints,
+    (num, den) tuples for rationals or bytes for ASCII/UNDEFINED fields.
+    """
+    count = struct.unpack(endian + 'H', reader.read(base + offset, 2))[0]
+    data = reader.read(base + offset + 2, count * 12 + 4)
+    entries = {}
+
+    for i in range(count):
+        tag, field_type, n, raw_value = struct.unpack(endian + 'HHL4s', data[i * 12:i * 12 + 12])
+        if field_type not in TIFF_TYPES or n == 0:
+            continue
+        fmt, size = TIFF_TYPES[field_type]
+        total = size * n
+        if total <= 4:
+            value = raw_value[:total]
+        else:
+            value_offset = struct.unpack(endian + 'L', raw_value)[0]
+            value = reader.read(base + value_offset, total)
+            if len(value) < total:
+                continue
+
+        if fmt == 's':
+            entries[tag] = value
+        elif field_type in (5, 10):
+            values = struct.unpack(endian + fmt[0] * (2 * n), value)
+            entries[tag] = values[:2] if n == 1 else tuple(zip(values[::2], values[1::2]))
+        else:
+            values = struct.unpack(endian + fmt * n, value)
+            entries[tag] = values[0] if n == 1 else values
+
+    next_offset = 0
+    if len(data) >= count * 12 + 4:
+        next_offset = struct.unpack(endian + 'L', data[count * 12:count * 12 + 4])[0]
+    return entries, next_offset
+
+
+def parse_tiff_header(reader, base):
+    """Return (endian, first_ifd_offset) of a TIFF block or None"""
+    header = reader.read(base, 8)
+    if len(header) < 8:
+        return None
+    if header[:2] == b'II':
+        endian = '<'
+    elif header[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    # 42 is standard TIFF; ORF uses 'RO'/'RS' in place of the magic number
+    magic = struct.unpack(endian + 'H', header[2:4])[0]
+    if magic not in (42, 0x4F52, 0x5352):
+        return None
+    return endian, struct.unpack(endian + 'L', header[4:8])[0]
+
+
+def read_tiff_tags(reader, base, follow_exif=True):
+    """Collect IFD0 tags of a TIFF block, merged with its EXIF sub-IFD"""
+    header = parse_tiff_header(reader, base)
+    if not header:
+        return {}
+    endian, ifd_offset = header
+    tags, _ = parse_ifd(reader, base, ifd_offset, endian)
+    if follow_exif and isinstance(tags.get(TAG_EXIF_IFD), int):
+        exif_tags, _ = parse_ifd(reader, base, tags[TAG_EXIF_IFD], endian)
+        tags.update(exif_tags)
+    return tags
+
+
+def iter_boxes(reader, start, end):
+    """Yield (type, payload_offset, payload_end) of ISO BMFF boxes in a range"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack('>L4s', reader.read(offset, 8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', reader.read(offset + 8, 8))[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def read_cr3_tags(reader):
+    """Collect tags from the CMT1 (IFD0) and CMT2 (EXIF) blocks of a CR3"""
+    for box_type, start, end in iter_boxes(reader, 0, reader.size):
+        if box_type != b'moov':
+            continue
+        for child_type, child_start, child_end in iter_boxes(reader, start, end):
+            if child_type != b'uuid' or reader.read(child_start, 16) != CR3_METADATA_UUID:
+                continue
+            tags = {}
+            for cmt_type, cmt_start, _ in iter_boxes(reader, child_start + 16, child_end):
+                # CMT1 holds IFD0; CMT2 is a TIFF block whose first IFD is the EXIF IFD
+                if cmt_type in (b'CMT1', b'CMT2'):
+                    tags.update(read_tiff_tags(reader, cmt_start, follow_exif=False))
+            return tags
+    return {}
+
+
+def find_jpeg_exif(reader, offset, length):
+    """Return the offset of the TIFF block inside a JPEG's APP1 Exif segment"""
+    end = offset + length
+    if reader.read(offset, 2) != b'\xff\xd8':
+        return None
+    pos = offset + 2
+    while pos + 4 <= end:
+        marker, segment_length = struct.unpack('>HH', reader.read(pos, 4))
+        if marker == 0xFFE1 and reader.read(pos + 4, 6) == b'Exif\x00\x00':
+            return pos + 10
+        if marker in (0xFFDA, 0xFFD9) or marker >> 8 != 0xFF:
+            return None
+        pos += 2 + segment_length
+    return None
+
+
+def read_raf_tags(reader):
+    """Collect tags from the JPEG preview embedded in a Fujifilm RAF"""
+    header = reader.read(0, 92)
+    if not header.startswith(b'FUJIFILMCCD-RAW'):
+        return {}
+    jpeg_offset, jpeg_length = struct.unpack('>LL', header[84:92])
+    tiff_offset = find_jpeg_exif(reader, jpeg_offset, jpeg_length)
+    if tiff_offset is None:
+        return {}
+    return read_tiff_tags(reader, tiff_offset)
+
+
+def read_tags(reader, ext):
+    """Dispatch on RAW container format"""
+    if ext == '.cr3':
+        return read_cr3_tags(reader)
+    if ext == '.raf':
+        return read_raf_tags(reader)
+    return read_tiff_tags(reader, 0)
+
+
+def _text(value):
+    return value.split(b'\x00', 1)[0].decode('ascii', 'ignore').strip()
+
+
+def tags_to_exif(tags):
+    """Convert raw TIFF tags to the dict shape returned by extract_exif_data()"""
+    exif_data = {
+        'camera_brand': '',
+        'camera_model': '',
+        'iso': None,
+        'aperture': None,
+        'shutter_speed': None,
+        'date': ''
+    }
+
+    if isinstance(tags.get(TAG_MAKE), bytes):
+        exif_data['camera_brand'] = _text(tags[TAG_MAKE])
+
+    if isinstance(tags.get(TAG_MODEL), bytes):
+        exif_data['camera_model'] = _text(tags[TAG_MODEL])
+
+    iso = tags.get(TAG_ISO)
+    if isinstance(iso, tuple):
+        iso = iso[0]
+    if isinstance(iso, int) and iso:
+        exif_data['iso'] = iso
+
+    f_number = tags.get(TAG_FNUMBER)
+    if isinstance(f_number, tuple) and len(f_number) == 2 and f_number[1]:
+        exif_data['aperture'] = round(f_number[0] / f_number[1], 1)
+
+    exposure = tags.get(TAG_EXPOSURE_TIME)
+    if isinstance(exposure, tuple) and len(exposure) == 2 and exposure[0] and exposure[1]:
+        num, den = exposure
+        if num == 1:
+            exif_data['shutter_speed'] = f"1/{den}"
+        elif num / den >= 1:
+            exif_data['shutter_speed'] = str(round(num / den, 2))
+        else:
+            exif_data['shutter_speed'] = f"1/{round(den / num)}"
+
+    for tag in (TAG_DATETIME_ORIGINAL, TAG_DATETIME):
+        if isinstance(tags.get(tag), bytes):
+            date = _text(tags[tag])
+            try:
+                datetime.datetime.strptime(date, '%Y:%m:%d %H:%M:%S')
+            except ValueError:
+                continue
+            exif_data['date'] = date
+            break
+
+    return exif_data
+
+
+def read_raw_exif(path):
+    """Read camera metadata from a RAW file header
+
+    Returns the extract_exif_data() dict, or None when the header could not be
+    parsed (callers then fall back to rawpy).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            tags = read_tags(RawReader(f), ext)
+    except Exception:
+        # Truncated or unknown layout; the caller falls back to rawpy
+        return None
+
+    if TAG_MAKE not in tags and TAG_MODEL not in tags:
+        return None
+    return tags_to_exif(tags)
+
+
+def jpeg_dimensions(reader, offset, length):
+    """Return (width, height) of a displayable JPEG stream or None"""
+    end = offset + length
+    if length < 4 or reader.read(offset, 2) != b'\xff\xd8':
+        return None
+    pos = offset + 2
+    while pos + 4 <= end:
+        marker, segment_length = struct.unpack('>HH', reader.read(pos, 4))
+        if marker >> 8 != 0xFF or marker in (0xFFDA, 0xFFD9):
+            return None
+        if 0xFFC0 <= marker <= 0xFFCF and marker not in (0xFFC4, 0xFFC8, 0xFFCC):
+            if marker not in DISPLAYABLE_SOF:
+                return None
+            height, width = struct.unpack('>HH', reader.read(pos + 5, 4))
+            return width, height
+        pos += 2 + segment_length
+    return None
+
+
+def iter_tiff_ifds(reader, base=0):
+    """Yield the tags of every IFD of a TIFF block (IFD0 first), following
+    the IFD chain and SubIFDs"""
+    header = parse_tiff_header(reader, base)
+    if not header:
+        return
+    endian, ifd_offset = header
+
+    pending = [ifd_offset]
+    seen = set()
+    while pending and len(seen) < 16:
+        offset = pending.pop(0)
+        if not offset or offset in seen:
+            continue
+        seen.add(offset)
+        tags, next_offset = parse_ifd(reader, base, offset, endian)
+        pending.append(next_offset)
+
+        sub_ifds = tags.get(TAG_SUB_IFDS)
+        if isinstance(sub_ifds, int):
+            pending.append(sub_ifds)
+        elif isinstance(sub_ifds, tuple):
+            pending.extend(sub_ifds)
+        yield tags
+
+
+def tiff_preview_candidates(reader, base=0):
+    """Collect (offset, length) of JPEG streams referenced by a TIFF block
+
+    Looks at JPEGInterchangeFormat pointers and single-strip JPEG-compressed
+    images in every IFD. Returns (candidates, orientation).
+    """
+    candidates = []
+    orientation = 1
+    for index, tags in enumerate(iter_tiff_ifds(reader, base)):
+        if index == 0 and isinstance(tags.get(TAG_ORIENTATION), int):
+            orientation = tags[TAG_ORIENTATION]
+
+        if isinstance(tags.get(TAG_JPEG_OFFSET), int) and isinstance(tags.get(TAG_JPEG_LENGTH), int):
+            candidates.append((base + tags[TAG_JPEG_OFFSET], tags[TAG_JPEG_LENGTH]))
+        if tags.get(TAG_COMPRESSION) in (6, 7) and isinstance(tags.get(TAG_STRIP_OFFSETS), int) \
+                and isinstance(tags.get(TAG_STRIP_BYTE_COUNTS), int):
+            # DNG keeps lossless raw data as compression 7; only reduced-res images are previews
+            if tags[TAG_COMPRESSION] == 6 or tags.get(TAG_NEW_SUBFILE_TYPE) == 1:
+                candidates.append((base + tags[TAG_STRIP_OFFSETS], tags[TAG_STRIP_BYTE_COUNTS]))
+
+    return candidates, orientation
+
+
+def cr3_preview_candidates(reader):
+    """Collect the PRVW preview of a CR3 and its CMT1 orientation"""
+    candidates = []
+    orientation = 1
+    for box_type, start, end in iter_boxes(reader, 0, reader.size):
+        if box_type == b'moov':
+            for child_type, child_start, child_end in iter_boxes(reader, start, end):
+                if child_type == b'uuid' and reader.read(child_start, 16) == CR3_METADATA_UUID:
+                    for cmt_type, cmt_start, _ in iter_boxes(reader, child_start + 16, child_end):
+                        if cmt_type == b'CMT1':
+                            tags = read_tiff_tags(reader, cmt_start, follow_exif=False)
+                            if isinstance(tags.get(TAG_ORIENTATION), int):
+                                orientation = tags[TAG_ORIENTATION]
+        elif box_type == b'uuid' and reader.read(start, 16) == CR3_PREVIEW_UUID:
+            # PRVW: a few header fields, the JPEG length, then the JPEG itself
+            payload = reader.read(start + 16, 64)
+            prvw = payload.find(b'PRVW')
+            jpeg = payload.find(b'\xff\xd8', prvw) if prvw >= 0 else -1
+            if jpeg >= 4:
+                length = struct.unpack('>L', payload[jpeg - 4:jpeg])[0]
+                candidates.append((start + 16 + jpeg, length))
+            break
+    return candidates, orientation
+
+
+def raf_preview_candidates(reader):
+    """The RAF header points straight at a JPEG preview (with its own EXIF)"""
+    header = reader.read(0, 92)
+    if not header.startswith(b'FUJIFILMCCD-RAW'):
+        return [], 1
+    return [struct.unpack('>LL', header[84:92])], 1
+
+
+def read_embedded_preview(path, min_size=0):
+    """Extract the embedded JPEG preview of a RAW file without decoding it
+
+    Picks the smallest displayable preview whose long edge covers min_size,
+    or the largest one available. Returns (jpeg_bytes, orientation) where
+    orientation is the RAW's EXIF orientation (1 when unknown), or None when
+    the file carries no usable preview.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            reader = RawReader(f)
+            if ext == '.cr3':
+                candidates, orientation = cr3_preview_candidates(reader)
+            elif ext == '.raf':
+                candidates, orientation = raf_preview_candidates(reader)
+            else:
+                candidates, orientation = tiff_preview_candidates(reader)
+
+            previews = []
+            for offset, length in candidates:
+                if offset + length > reader.size:
+                    continue
+                dimensions = jpeg_dimensions(reader, offset, length)
+                if dimensions:
+                    previews.append((max(dimensions), offset, length))
+            if not previews:
+                return None
+
+            previews.sort()
+            covering = [preview for preview in previews if preview[0] >= min_size]
+            _, offset, length = covering[0] if covering else previews[-1]
+            return reader.read(offset, length), orientation
+    except Exception:
+        return None
+
+
+def read_raw_dimensions(path):
+    """(width, height) of the largest image in a TIFF-based RAW, the sensor
+    data, read without LibRaw; None for CR3/RAF or unparsable headers"""
+    if os.path.splitext(path)[1].lower() in ('.cr3', '.raf'):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            sizes = [(tags[TAG_IMAGE_WIDTH], tags[TAG_IMAGE_LENGTH])
+                     for tags in iter_tiff_ifds(RawReader(f))
+                     if isinstance(tags.get(TAG_IMAGE_WIDTH), int) and isinstance(tags.get(TAG_IMAGE_LENGTH), int)]
+    except Exception:
+        return None
+    return max(sizes, key=lambda size: size[0] * size[1], default=None)
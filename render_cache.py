@@ -0,0 +1,405 @@
+"""
+On-disk cache for rendered thumbnails
+
+Keys are derived from the file content, not its path: size, mtime and the
+first 64 KB. A re-exported file with the same name gets a new key, while a
+moved or restored file keeps its key and reuses the cached rendering. The
+path -> key alias table in the catalog avoids re-reading the file head on
+every request.
+
+Generation is single-flight across gunicorn workers: a striped table of
+flock()ed lock files makes concurrent requests for the same file wait for
+the first decoder, and results are written to a temp file and renamed into
+place so readers never see a torn image.
+
+The cache is bounded: every file written is tracked in the catalog with its
+size, last access and hit count, and once the total exceeds the configured
+budget the least recently (or least frequently) used files are evicted.
+sweep_cache() reconciles the directory with the catalog and removes
+renderings whose source files no longer exist.
+
+Files are sharded two levels deep (ab/cd/abcd....jpg) to keep directories
+small. Caches from the old flat layout are migrated online: a flat file is
+moved the first time it is looked up, and one worker per deployment moves
+the rest in the background.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import catalog
+
+# Bytes hashed to tell apart files with equal size and mtime (burst shots)
+FINGERPRINT_BYTES = 64 * 1024
+
+# Number of lock files generation locks are striped over
+LOCK_STRIPES = 256
+# Seconds to wait for another worker before rendering anyway
+LOCK_TIMEOUT = 120
+
+# Accesses are buffered per worker and written in one transaction
+TOUCH_FLUSH_SECONDS = 30
+# Minimum seconds between budget checks of one worker
+BUDGET_CHECK_SECONDS = 60
+# Eviction stops once the cache is back under this share of the budget
+EVICTION_TARGET = 0.9
+
+_touches = {}
+_touch_lock = threading.Lock()
+_last_flush = 0
+_last_budget_check = 0
+
+# Files moved per batch by the background migration, and pause between batches
+MIGRATION_BATCH = 500
+MIGRATION_PAUSE = 0.2
+
+_migration_started = False
+_migration_lock = threading.Lock()
+
+
+def content_key(path, size, mtime_ns):
+    """Hash size, mtime and the head of the file into a cache key"""
+    digest = hashlib.md5(f"{size}:{mtime_ns}:".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, key, suffix):
+    """Sharded location of a cache file: <cache_dir>/ab/cd/<key><suffix>"""
+    return os.path.join(cache_dir, key[:2], key[2:4], key + suffix)
+
+
+def migrate_flat_file(db_path, cache_dir, name):
+    """Move one file of the old flat layout into its shard; returns the new path"""
+    key = name.split('.')[0].split('_')[0]
+    target = os.path.join(cache_dir, key[:2], key[2:4], name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(os.path.join(cache_dir, name), target)
+    try:
+        catalog.rename_cache_entry(db_path, name, os.path.relpath(target, cache_dir))
+    except Exception as e:
+        print(f"Error tracking migrated cache file {name}: {e}")
+    return target
+
+
+def find_cached(db_path, cache_dir, path):
+    """Whether a sharded cache file exists, migrating it from the flat layout if needed"""
+    if os.path.exists(path):
+        return True
+    name = os.path.basename(path)
+    if os.path.exists(os.path.join(cache_dir, name)):
+        try:
+            migrate_flat_file(db_path, cache_dir, name)
+        except FileNotFoundError:
+            # The background migration moved it first
+            pass
+    return os.path.exists(path)
+
+
+def migrate_flat_cache(db_path, cache_dir, lock_dir):
+    """Move every flat cache file into its shard, in small batches
+
+    Only one process migrates at a time; the others return immediately.
+    Returns the number of files moved (None if another process holds the job).
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, 'migration.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        moved = 0
+        failed = set()
+        while True:
+            with os.scandir(cache_dir) as entries:
+                batch = [entry.name for entry in entries
+                         if not entry.name.startswith('.') and entry.name not in failed
+                         and entry.is_file()][:MIGRATION_BATCH]
+            if not batch:
+                break
+            for name in batch:
+                try:
+                    migrate_flat_file(db_path, cache_dir, name)
+                    moved += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error migrating cache file {name}: {e}")
+                    failed.add(name)
+            time.sleep(MIGRATION_PAUSE)
+
+        if moved:
+            print(f"Migrated {moved} thumbnails to the sharded cache layout")
+        return moved
+
+
+def start_migration(db_path, cache_dir, lock_dir):
+    """Run migrate_flat_cache() once per process on a daemon thread"""
+    global _migration_started
+    with _migration_lock:
+        if _migration_started:
+            return
+        _migration_started = True
+
+    def run():
+        try:
+            migrate_flat_cache(db_path, cache_dir, lock_dir)
+        except Exception as e:
+            print(f"Error migrating thumbnail cache: {e}")
+
+    threading.Thread(target=run, name='cache-migration', daemon=True).start()
+
+
+def cache_key(path, db_path):
+    """Return the content-versioned cache key of a file
+
+    Uses the catalog alias when the file's stat signature still matches it;
+    otherwise fingerprints the file and records the new alias.
+    """
+    stat = os.stat(path)
+    try:
+        alias = catalog.get_alias(db_path, path)
+    except Exception as e:
+        print(f"Error reading cache alias for {path}: {e}")
+        alias = None
+    if alias and alias[:2] == (stat.st_size, stat.st_mtime_ns):
+        return alias[2]
+
+    key = content_key(path, stat.st_size, stat.st_mtime_ns)
+    try:
+        catalog.set_alias(db_path, path, stat.st_size, stat.st_mtime_ns, key)
+    except Exception as e:
+        print(f"Error storing cache alias for {path}: {e}")
+    return key
+
+
+def rename_source(db_path, old_path, new_path):
+    """Carry a file's cache key over to its new path after a move"""
+    try:
+        catalog.move_alias(db_path, old_path, new_path)
+    except Exception as e:
+        print(f"Error moving cache alias for {old_path}: {e}")
+
+
+def forget_source(db_path, cache_dir, path):
+    """Drop the alias of a deleted file and its renderings once nothing else uses them"""
+    try:
+        alias = catalog.get_alias(db_path, path)
+        catalog.delete_alias(db_path, path)
+        if alias and not catalog.alias_paths(db_path, alias[2]):
+            remove_files(db_path, cache_dir, catalog.cache_files_for_key(db_path, alias[2]))
+    except Exception as e:
+        print(f"Error deleting cache alias for {path}: {e}")
+
+
+@contextlib.contextmanager
+def single_flight(target_path, lock_dir):
+    """Hold the cross-process lock guarding generation of target_path
+
+    Callers re-check whether target_path exists once inside, since another
+    worker may have produced it while they waited.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    stripe = int(hashlib.md5(target_path.encode()).hexdigest(), 16) % LOCK_STRIPES
+    with open(os.path.join(lock_dir, f"{stripe:03d}.lock"), 'a') as lock_file:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        locked = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    print(f"Timed out waiting for render lock of {target_path}")
+                    break
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if locked:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def save_image(img, target_path, *args, **kwargs):
+    """Save a PIL image through a temp file renamed into place"""
+    directory = os.path.dirname(target_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.splitext(target_path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, *args, **kwargs)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def record_entry(db_path, cache_dir, file_path, key, max_bytes, policy):
+    """Track a freshly written cache file and keep the cache within budget"""
+    global _last_budget_check
+    now = time.time()
+    try:
+        catalog.add_cache_entry(db_path, os.path.relpath(file_path, cache_dir), key,
+                                os.path.getsize(file_path), now)
+        if now - _last_budget_check > BUDGET_CHECK_SECONDS:
+            _last_budget_check = now
+            enforce_budget(db_path, cache_dir, max_bytes, policy)
+    except Exception as e:
+        print(f"Error tracking cache file {file_path}: {e}")
+
+
+def touch(db_path, cache_dir, file_path):
+    """Note a cache hit; flushed to the catalog at most every TOUCH_FLUSH_SECONDS"""
+    global _last_flush
+    now = time.time()
+    file = os.path.relpath(file_path, cache_dir)
+    with _touch_lock:
+        hits, _ = _touches.get(file, (0, now))
+        _touches[file] = (hits + 1, now)
+        if now - _last_flush < TOUCH_FLUSH_SECONDS:
+            return
+        pending = dict(_touches)
+        _touches.clear()
+        _last_flush = now
+    try:
+        catalog.touch_cache_entries(db_path, pending)
+    except Exception as e:
+        print(f"Error recording cache accesses: {e}")
+
+
+def remove_files(db_path, cache_dir, files):
+    """Delete cache files from disk and from the catalog; returns bytes freed"""
+    freed = 0
+    for file in files:
+        try:
+            path = os.path.join(cache_dir, file)
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    catalog.delete_cache_entries(db_path, files)
+    return freed
+
+
+def enforce_budget(db_path, cache_dir, max_bytes, policy):
+    """Evict LRU (or LFU) entries until the cache fits its byte budget
+
+    Returns the number of files evicted.
+    """
+    _, total, _, _ = catalog.cache_totals(db_path)
+    if total <= max_bytes:
+        return 0
+
+    target = max_bytes * EVICTION_TARGET
+    evicted = 0
+    while total > target:
+        candidates = catalog.eviction_candidates(db_path, policy, 500)
+        if not candidates:
+            break
+        batch = []
+        for file, size in candidates:
+            if total <= target:
+                break
+            batch.append(file)
+            total -= size
+        remove_files(db_path, cache_dir, batch)
+        evicted += len(batch)
+    return evicted
+
+
+def mount_available(mount_point):
+    """Whether a configured mount point is there: it exists and is either
+    a mount or not empty (an unmounted share leaves an empty directory)"""
+    try:
+        return os.path.isdir(mount_point) and (os.path.ismount(mount_point) or any(os.scandir(mount_point)))
+    except OSError:
+        return False
+
+
+def source_gone(path, mount_points):
+    """Whether a source file is known to be deleted, not merely unreachable
+
+    Its folder must still exist, and so must the mount point it lives
+    under, so a NAS share that is briefly unmounted keeps its cache.
+    """
+    if os.path.exists(path) or not os.path.isdir(os.path.dirname(path)):
+        return False
+    for mount_point in mount_points:
+        if path.startswith(os.path.join(mount_point, '')):
+            return mount_available(mount_point)
+    return True
+
+
+def sweep_cache(db_path, cache_dir, max_bytes, policy, mount_points=()):
+    """Reconcile the cache directory with the catalog
+
+    - untracked files (written before tracking existed) are adopted
+    - tracked entries whose file vanished are dropped
+    - renderings whose source files are all deleted are deleted; sources on
+      an unavailable mount point or in a missing folder count as present
+    - the byte budget is enforced
+    Returns counts of each action.
+    """
+    tracked = catalog.cache_entries(db_path)
+    on_disk = set()
+    adopted = 0
+    for root, dirs, files in os.walk(cache_dir):
+        # Lock files and in-progress temp files are not cache entries
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(root, name)
+            file = os.path.relpath(path, cache_dir)
+            on_disk.add(file)
+            if file not in tracked:
+                stat = os.stat(path)
+                key = name.split('.')[0].split('_')[0]
+                catalog.add_cache_entry(db_path, file, key, stat.st_size, stat.st_mtime)
+                tracked[file] = key
+                adopted += 1
+
+    missing = [file for file in tracked if file not in on_disk]
+    catalog.delete_cache_entries(db_path, missing)
+
+    orphans = []
+    keys = {}
+    for file, key in tracked.items():
+        if file in on_disk:
+            keys.setdefault(key, []).append(file)
+    for key, files in keys.items():
+        sources = catalog.alias_paths(db_path, key)
+        if all(source_gone(path, mount_points) for path in sources):
+            orphans.extend(files)
+            catalog.delete_aliases_for_key(db_path, key)
+    remove_files(db_path, cache_dir, orphans)
+
+    return {
+        'adopted': adopted,
+        'missing': len(missing),
+        'orphans_removed': len(orphans),
+        'evicted': enforce_budget(db_path, cache_dir, max_bytes, policy)
+    }
+
+
+def cache_stats(db_path, max_bytes, policy):
+    """Summary of the render cache for the stats endpoint"""
+    entries, total, hits, oldest = catalog.cache_totals(db_path)
+    return {
+        'entries': entries,
+        'bytes': total,
+        'budget_bytes': max_bytes,
+        'usage': round(total / max_bytes, 3) if max_bytes else 0,
+        'hits': hits,
+        'oldest_access': oldest,
+        'policy': policy
+    }
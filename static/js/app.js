@@ -11,9 +11,23 @@ const state = {
     lastMarkedIndex: null,  // For shift+click range selection
     navigationHistory: [],  // History of visited paths
     historyIndex: -1,  // Current position in history
-    bookmarks: []  // Favorite folders
+    bookmarks: [],  // Favorite folders
+    scanController: null,  // Aborts the metadata stream of the previous folder
+    fullResolution: false,  // Carousel loads originals instead of viewport-sized copies
+    zoom: null,  // Deep-zoom viewer of the current carousel photo (see enterZoom)
+    prefetchTimer: null  // Debounces prefetch announcements while navigating
 };
 
+// Thumbnail tiers served by /api/thumbnail and the approximate grid tile width
+const THUMBNAIL_TIERS = [160, 320, 640];
+const THUMBNAIL_SIZES = '(max-width: 480px) 50vw, 240px';
+// A thumbnail that fails (e.g. 503 while the RAW decoders are busy) is retried
+const THUMBNAIL_RETRIES = 3;
+const THUMBNAIL_RETRY_MS = 5000;
+// A carousel video the server turns away (429 over the stream limit) is retried
+const VIDEO_RETRIES = 5;
+const VIDEO_RETRY_MS = 2000;
+
 // Initialize app
 document.addEventListener('DOMContentLoaded', () => {
     initTabs();
@@ -77,6 +91,10 @@ function setupEventListeners() {
     document.getElementById('carousel-prev').addEventListener('click', () => navigateCarousel(-1));
     document.getElementById('carousel-next').addEventListener('click', () => navigateCarousel(1));
     document.getElementById('carousel-close').addEventListener('click', closeCarousel);
+    document.getElementById('carousel-image').addEventListener('dblclick', (e) => enterZoom(e.clientX, e.clientY));
+    window.addEventListener('resize', () => {
+        if (state.zoom) renderZoom();
+    });
 
     // Delete modal events
     document.getElementById('delete-cancel').addEventListener('click', hideDeleteModal);
@@ -335,33 +353,153 @@ async function loadSubfolders(path) {
     }
 }
 
+// Parse a newline-delimited JSON response body record by record
+async function* readNdjson(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (line.trim()) yield JSON.parse(line);
+        }
+    }
+
+    if (buffer.trim()) yield JSON.parse(buffer);
+}
+
+// Resolves as soon as the folder listing arrives; EXIF keeps streaming in afterwards
 async function loadPhotos(path) {
     if (!path) {
         return [];
     }
 
+    // Stop enriching the previous folder
+    if (state.scanController) {
+        state.scanController.abort();
+    }
+    const controller = new AbortController();
+    state.scanController = controller;
+
     try {
-        const response = await fetch(`/api/scan?path=${encodeURIComponent(path)}`);
-        const data = await response.json();
+        const response = await fetch(`/api/scan/stream?path=${encodeURIComponent(path)}`, {
+            signal: controller.signal
+        });
 
-        if (data.error || !data.photos) {
+        if (!response.ok) {
             return [];
         }
 
-        state.photos = data.photos;
+        const records = readNdjson(response);
+        const photos = [];
+
+        // Listing phase: names, sizes and pairing
+        while (true) {
+            const { value: record, done } = await records.next();
+            if (done || record.event === 'listed') break;
+            if (record.event === 'error') {
+                console.error('Error scanning folder:', record.error);
+                return [];
+            }
+            if (record.event === 'photo') {
+                photos[record.index] = record.photo;
+            }
+        }
+
+        state.photos = photos;
         state.markedPhotos.clear();
         state.loadedPhotos = 50;
 
         // Check if this is a review folder
         checkIfReviewFolder();
 
-        return data.photos;
+        // Enrichment phase continues in the background
+        applyExifRecords(records, controller);
+        watchThumbnailProgress(path, controller);
+
+        return photos;
     } catch (error) {
-        console.error('Error loading photos:', error);
+        if (error.name !== 'AbortError') {
+            console.error('Error loading photos:', error);
+        }
         return [];
     }
 }
 
+async function applyExifRecords(records, controller) {
+    try {
+        for await (const record of records) {
+            if (controller.signal.aborted) return;
+            if (record.event === 'exif') {
+                updatePhotoMetadata(record.index, record);
+            } else if (record.event === 'error') {
+                console.error('Error reading metadata:', record.error);
+            }
+        }
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error reading metadata:', error);
+        }
+    }
+}
+
+// Poll background thumbnail generation of the open folder until it finishes
+async function watchThumbnailProgress(path, controller) {
+    const indicator = document.getElementById('thumbnail-progress');
+    indicator.textContent = '';
+
+    while (!controller.signal.aborted) {
+        try {
+            const response = await fetch(`/api/thumbnails/progress?path=${encodeURIComponent(path)}`, {
+                signal: controller.signal
+            });
+            if (!response.ok) break;
+
+            const progress = await response.json();
+            if (progress.total === 0 || progress.completed >= progress.total) break;
+            indicator.textContent = `Miniaturas ${progress.completed}/${progress.total}`;
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Error reading thumbnail progress:', error);
+            }
+            return;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1500));
+    }
+
+    if (!controller.signal.aborted) {
+        indicator.textContent = '';
+    }
+}
+
+function updatePhotoMetadata(index, fields) {
+    const photo = state.photos[index];
+    if (!photo) return;
+
+    ['camera_brand', 'camera_model', 'iso', 'aperture', 'shutter_speed', 'date'].forEach(field => {
+        if (fields[field] !== undefined) {
+            photo[field] = fields[field];
+        }
+    });
+
+    // Refresh the tile badges (camera brand) if it is already rendered
+    const tile = document.querySelector(`.photo-item[data-index="${index}"]`);
+    if (tile) {
+        tile.querySelector('.photo-badges').replaceWith(createBadges(photo));
+    }
+
+    if (state.currentView === 'carousel' && state.currentCarouselIndex === index) {
+        updateCarouselMetadata(photo);
+    }
+}
+
 // Breadcrumb Navigation
 function updateBreadcrumb(path) {
     const breadcrumbPath = document.getElementById('breadcrumb-path');
@@ -496,6 +634,7 @@ function renderPhotos(photos) {
     photosToLoad.forEach((photo, index) => {
         const div = document.createElement('div');
         div.className = 'photo-item';
+        div.dataset.index = index;
         if (state.markedPhotos.has(index)) {
             div.classList.add('marked');
         }
@@ -506,7 +645,9 @@ function renderPhotos(photos) {
         div.title = `${photo.name}\n${sizeKB} KB - ${rawStatus}`;
 
         const img = document.createElement('img');
-        img.src = `/api/thumbnail?path=${encodeURIComponent(photo.display_path)}`;
+        img.dataset.thumbnailUrl = `/api/thumbnail?path=${encodeURIComponent(photo.display_path)}&v=${photo.version}`;
+        setThumbnailSources(img, img.dataset.thumbnailUrl);
+        img.sizes = THUMBNAIL_SIZES;
         img.loading = 'lazy';
         img.alt = photo.name;
 
@@ -514,6 +655,7 @@ function renderPhotos(photos) {
         img.addEventListener('load', () => {
             img.classList.add('loaded');
         });
+        img.addEventListener('error', () => retryThumbnail(img));
 
         const checkbox = document.createElement('div');
         checkbox.className = 'photo-checkbox';
@@ -657,10 +799,12 @@ function showCarousel(index) {
     document.getElementById('carousel-view').classList.add('active');
 
     updateCarousel();
-    preloadNextImage();
+    prefetchAround();
 }
 
 function updateCarousel() {
+    exitZoom();
+
     const photo = state.photos[state.currentCarouselIndex];
     const img = document.getElementById('carousel-image');
     const video = document.getElementById('carousel-video');
@@ -675,9 +819,6 @@ function updateCarousel() {
         img.style.display = 'none';
         video.style.display = 'block';
 
-        // Set video source
-        video.src = `/api/video?path=${encodeURIComponent(photo.display_path)}`;
-
         // Add marked class if needed
         if (state.markedPhotos.has(state.currentCarouselIndex)) {
             video.classList.add('marked');
@@ -685,15 +826,7 @@ function updateCarousel() {
             video.classList.remove('marked');
         }
 
-        // Hide loading when video can play
-        video.addEventListener('loadeddata', () => {
-            loadingOverlay.style.display = 'none';
-        }, { once: true });
-
-        video.addEventListener('error', () => {
-            loadingOverlay.style.display = 'none';
-            showToast('Error cargando video', 'error');
-        }, { once: true });
+        loadCarouselVideo(video, photo);
 
     } else {
         // It's an image
@@ -702,8 +835,7 @@ function updateCarousel() {
         img.style.display = 'block';
 
         // Pause video if it was playing
-        video.pause();
-        video.src = '';
+        stopVideo();
 
         // Create a new image to preload
         const newImg = new Image();
@@ -720,7 +852,7 @@ function updateCarousel() {
             }
 
             // Update dimensions after image loads
-            document.getElementById('meta-dimensions').textContent = `${newImg.naturalWidth} x ${newImg.naturalHeight} px`;
+            updateDimensions(newImg);
         };
 
         newImg.onerror = () => {
@@ -730,7 +862,7 @@ function updateCarousel() {
         };
 
         // Start loading the image
-        newImg.src = `/api/image?path=${encodeURIComponent(photo.display_path)}`;
+        newImg.src = carouselImageUrl(photo);
     }
 
     // Update carousel badges
@@ -752,7 +884,7 @@ function updateCarouselMetadata(photo) {
     // Dimensiones: (siempre visible, se actualiza cuando carga la imagen)
     const img = document.getElementById('carousel-image');
     if (photo.type !== 'video' && img.complete && img.naturalWidth) {
-        document.getElementById('meta-dimensions').textContent = `${img.naturalWidth} x ${img.naturalHeight} px`;
+        updateDimensions(img);
     } else {
         document.getElementById('meta-dimensions').textContent = '-';
     }
@@ -803,13 +935,362 @@ function updateCarouselMetadata(photo) {
     }
 }
 
-function preloadNextImage() {
-    // Preload next image for smoother navigation
-    const nextIndex = (state.currentCarouselIndex + 1) % state.photos.length;
-    const nextPhoto = state.photos[nextIndex];
+async function retryThumbnail(img) {
+    const attempt = Number(img.dataset.retries || 0) + 1;
+    if (attempt > THUMBNAIL_RETRIES) return;
+    img.dataset.retries = attempt;
 
-    const preloadImg = new Image();
-    preloadImg.src = `/api/image?path=${encodeURIComponent(nextPhoto.display_path)}`;
+    // An <img> cannot read response headers: ask once more to learn why it
+    // failed and how long the server wants us to wait (Retry-After on 503)
+    let delay = THUMBNAIL_RETRY_MS * attempt;
+    try {
+        const response = await fetch(`${img.currentSrc || img.src}&retry=${attempt}`);
+        if (response.ok) {
+            delay = 0;
+        } else if (response.status === 503) {
+            delay = retryAfterMs(response, delay);
+        } else {
+            return;
+        }
+    } catch (error) {
+        // Network error: keep the default backoff
+    }
+
+    setTimeout(() => {
+        // A new URL so the browser does not reuse the failed response
+        setThumbnailSources(img, `${img.dataset.thumbnailUrl}&retry=${attempt}`);
+    }, delay);
+}
+
+// Point the carousel player at a video, retrying (from the same position)
+// when the server asks it to come back later
+function loadCarouselVideo(video, photo, attempt = 0, position = 0, playing = false) {
+    const loadingOverlay = document.getElementById('carousel-loading-overlay');
+    const url = `/api/video?path=${encodeURIComponent(photo.display_path)}&v=${photo.version}`;
+    // A new URL on retries so the browser does not reuse the failed response
+    video.src = attempt ? `${url}&retry=${attempt}` : url;
+    // Listeners of a load that was replaced before firing do nothing
+    const src = video.src;
+
+    video.addEventListener('loadedmetadata', () => {
+        if (video.src !== src) return;
+        if (position) video.currentTime = position;
+        if (playing) video.play().catch(() => {});
+    }, { once: true });
+
+    // Hide loading when video can play
+    video.addEventListener('loadeddata', () => {
+        loadingOverlay.style.display = 'none';
+    }, { once: true });
+
+    video.addEventListener('error', async () => {
+        const current = () => video.src === src && state.photos[state.currentCarouselIndex] === photo;
+        if (!current()) return;
+        const resumeAt = video.currentTime;
+        const wasPlaying = !video.paused;
+
+        // <video> cannot read the Retry-After of a 429: a one-byte request asks for it
+        let delay = null;
+        if (attempt < VIDEO_RETRIES) {
+            try {
+                const response = await fetch(`${url}&retry=${attempt + 1}`, { headers: { Range: 'bytes=0-0' } });
+                if (response.status === 429 || response.status === 503) {
+                    delay = retryAfterMs(response, VIDEO_RETRY_MS);
+                }
+            } catch (error) {
+                // Network error: keep the default backoff
+                delay = VIDEO_RETRY_MS * (attempt + 1);
+            }
+        }
+        if (delay === null) {
+            loadingOverlay.style.display = 'none';
+            showToast('Error cargando video', 'error');
+            return;
+        }
+
+        setTimeout(() => {
+            if (current()) loadCarouselVideo(video, photo, attempt + 1, resumeAt, wasPlaying);
+        }, delay);
+    }, { once: true });
+}
+
+// Milliseconds a response's Retry-After header asks for, or fallbackMs
+function retryAfterMs(response, fallbackMs) {
+    const seconds = Number(response.headers.get('Retry-After'));
+    return seconds > 0 ? seconds * 1000 : fallbackMs;
+}
+
+function setThumbnailSources(img, thumbnailUrl) {
+    img.src = `${thumbnailUrl}&size=320`;
+    // Let the browser pick the tier for the tile width and pixel density
+    img.srcset = THUMBNAIL_TIERS.map(tier => `${thumbnailUrl}&size=${tier} ${tier}w`).join(', ');
+}
+
+// Carousel viewport in device pixels, or null in full resolution mode
+function carouselViewport() {
+    if (state.fullResolution) {
+        return null;
+    }
+
+    const content = document.querySelector('.carousel-content');
+    const dpr = window.devicePixelRatio || 1;
+    return {
+        w: Math.round((content.clientWidth || window.innerWidth) * dpr),
+        h: Math.round((content.clientHeight || window.innerHeight) * dpr)
+    };
+}
+
+// Image URL sized for the carousel viewport, or the original in full resolution mode
+function carouselImageUrl(photo) {
+    const url = `/api/image?path=${encodeURIComponent(photo.display_path)}&v=${photo.version}`;
+    const viewport = carouselViewport();
+    // Full resolution mode also asks for the full-quality RAW render
+    return viewport ? `${url}&w=${viewport.w}&h=${viewport.h}` : `${url}&profile=full`;
+}
+
+function updateDimensions(img) {
+    const suffix = state.fullResolution ? '' : ' (ajustada)';
+    document.getElementById('meta-dimensions').textContent = `${img.naturalWidth} x ${img.naturalHeight} px${suffix}`;
+}
+
+function toggleFullResolution() {
+    state.fullResolution = !state.fullResolution;
+    showToast(state.fullResolution ? 'Resolución completa' : 'Ajustada a la pantalla', 'info');
+    updateCarousel();
+    prefetchAround();
+}
+
+// Zoom mode: the photo at 100% (one image pixel per device pixel) from deep-zoom
+// tiles; only the tiles covering the viewport at the current level are fetched
+async function enterZoom(clientX, clientY) {
+    const index = state.currentCarouselIndex;
+    const photo = state.photos[index];
+    if (!photo || photo.type === 'video' || state.zoom) return;
+
+    // The pyramid is cut from the display preview, or the full-quality render in full resolution mode
+    const profile = state.fullResolution ? '&profile=full' : '';
+    const query = `path=${encodeURIComponent(photo.display_path)}&v=${photo.version}${profile}`;
+    let info;
+    try {
+        const response = await fetch(`/api/tiles/info?${query}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        info = await response.json();
+    } catch (error) {
+        console.error('Error loading zoom:', error);
+        showToast('Error cargando zoom', 'error');
+        return;
+    }
+    if (state.currentCarouselIndex !== index || state.currentView !== 'carousel' || state.zoom) return;
+
+    // Center on the double-clicked point (the middle of the photo from the keyboard)
+    const img = document.getElementById('carousel-image');
+    const rect = img.getBoundingClientRect();
+    const fx = clientX === undefined || !rect.width ? 0.5 : (clientX - rect.left) / rect.width;
+    const fy = clientY === undefined || !rect.height ? 0.5 : (clientY - rect.top) / rect.height;
+
+    const viewer = document.createElement('div');
+    viewer.className = 'carousel-zoom';
+
+    // The screen-sized image stays underneath, stretched, until the tiles arrive
+    const placeholder = document.createElement('img');
+    placeholder.className = 'zoom-placeholder';
+    placeholder.src = img.src;
+    viewer.appendChild(placeholder);
+
+    document.querySelector('.carousel-content').appendChild(viewer);
+
+    state.zoom = {
+        query,
+        info,
+        viewer,
+        placeholder,
+        level: info.max_level,
+        centerX: Math.min(Math.max(fx, 0), 1) * info.width,
+        centerY: Math.min(Math.max(fy, 0), 1) * info.height,
+        tiles: new Map()
+    };
+
+    initZoomGestures(viewer);
+    renderZoom();
+}
+
+function exitZoom() {
+    if (!state.zoom) return;
+    state.zoom.viewer.remove();
+    state.zoom = null;
+}
+
+function toggleZoom() {
+    if (state.zoom) {
+        exitZoom();
+    } else {
+        enterZoom();
+    }
+}
+
+// Level pixels per full-resolution pixel
+function zoomScale(zoom) {
+    return Math.pow(2, zoom.level - zoom.info.max_level);
+}
+
+function renderZoom() {
+    const zoom = state.zoom;
+    const { info, viewer } = zoom;
+    const dpr = window.devicePixelRatio || 1;
+    const scale = zoomScale(zoom);
+    const levelWidth = Math.ceil(info.width * scale);
+    const levelHeight = Math.ceil(info.height * scale);
+    const viewWidth = viewer.clientWidth * dpr;
+    const viewHeight = viewer.clientHeight * dpr;
+
+    // Keep the photo on screen (centered when it is smaller than the viewport)
+    const clampCenter = (center, size, view) => {
+        if (size * scale <= view) return size / 2;
+        const margin = view / 2 / scale;
+        return Math.min(Math.max(center, margin), size - margin);
+    };
+    zoom.centerX = clampCenter(zoom.centerX, info.width, viewWidth);
+    zoom.centerY = clampCenter(zoom.centerY, info.height, viewHeight);
+
+    // Viewport origin in level pixels
+    const left = zoom.centerX * scale - viewWidth / 2;
+    const top = zoom.centerY * scale - viewHeight / 2;
+
+    const placeholder = zoom.placeholder.style;
+    placeholder.left = `${-left / dpr}px`;
+    placeholder.top = `${-top / dpr}px`;
+    placeholder.width = `${levelWidth / dpr}px`;
+    placeholder.height = `${levelHeight / dpr}px`;
+
+    const size = info.tile_size;
+    const firstX = Math.max(0, Math.floor(left / size));
+    const lastX = Math.min(Math.ceil(levelWidth / size), Math.ceil((left + viewWidth) / size)) - 1;
+    const firstY = Math.max(0, Math.floor(top / size));
+    const lastY = Math.min(Math.ceil(levelHeight / size), Math.ceil((top + viewHeight) / size)) - 1;
+
+    const visible = new Set();
+    for (let y = firstY; y <= lastY; y++) {
+        for (let x = firstX; x <= lastX; x++) {
+            const key = `${zoom.level}/${x}/${y}`;
+            visible.add(key);
+
+            let tile = zoom.tiles.get(key);
+            if (!tile) {
+                tile = document.createElement('img');
+                tile.className = 'zoom-tile';
+                tile.src = `/api/tiles?${zoom.query}&level=${zoom.level}&x=${x}&y=${y}`;
+                zoom.tiles.set(key, tile);
+                viewer.appendChild(tile);
+            }
+            tile.style.left = `${(x * size - left) / dpr}px`;
+            tile.style.top = `${(y * size - top) / dpr}px`;
+            tile.style.width = `${Math.min(size, levelWidth - x * size) / dpr}px`;
+            tile.style.height = `${Math.min(size, levelHeight - y * size) / dpr}px`;
+        }
+    }
+
+    // Tiles that left the viewport are dropped (pending downloads get cancelled)
+    for (const [key, tile] of zoom.tiles) {
+        if (!visible.has(key)) {
+            tile.remove();
+            zoom.tiles.delete(key);
+        }
+    }
+}
+
+function initZoomGestures(viewer) {
+    let drag = null;
+    let frame = null;
+    const scheduleRender = () => {
+        if (frame) return;
+        frame = requestAnimationFrame(() => {
+            frame = null;
+            if (state.zoom) renderZoom();
+        });
+    };
+
+    // Drag to pan
+    viewer.addEventListener('pointerdown', (e) => {
+        drag = { x: e.clientX, y: e.clientY };
+        viewer.setPointerCapture(e.pointerId);
+        viewer.classList.add('dragging');
+    });
+    viewer.addEventListener('pointermove', (e) => {
+        if (!drag || !state.zoom) return;
+        const factor = (window.devicePixelRatio || 1) / zoomScale(state.zoom);
+        state.zoom.centerX -= (e.clientX - drag.x) * factor;
+        state.zoom.centerY -= (e.clientY - drag.y) * factor;
+        drag = { x: e.clientX, y: e.clientY };
+        scheduleRender();
+    });
+    const endDrag = () => {
+        drag = null;
+        viewer.classList.remove('dragging');
+    };
+    viewer.addEventListener('pointerup', endDrag);
+    viewer.addEventListener('pointercancel', endDrag);
+
+    // Wheel steps through pyramid levels (100% down to 1:16), keeping the point under the cursor
+    viewer.addEventListener('wheel', (e) => {
+        e.preventDefault();
+        const zoom = state.zoom;
+        if (!zoom) return;
+        const level = Math.min(zoom.info.max_level, Math.max(zoom.info.max_level - 4,
+            zoom.level + (e.deltaY < 0 ? 1 : -1)));
+        if (level === zoom.level) return;
+
+        const rect = viewer.getBoundingClientRect();
+        const dpr = window.devicePixelRatio || 1;
+        const offsetX = (e.clientX - rect.left - rect.width / 2) * dpr;
+        const offsetY = (e.clientY - rect.top - rect.height / 2) * dpr;
+        const pointX = zoom.centerX + offsetX / zoomScale(zoom);
+        const pointY = zoom.centerY + offsetY / zoomScale(zoom);
+        zoom.level = level;
+        zoom.centerX = pointX - offsetX / zoomScale(zoom);
+        zoom.centerY = pointY - offsetY / zoomScale(zoom);
+        scheduleRender();
+    }, { passive: false });
+
+    viewer.addEventListener('dblclick', exitZoom);
+}
+
+// Photos the server warms around the carousel position, in the direction of travel and behind
+const PREFETCH_AHEAD = 4;
+const PREFETCH_BEHIND = 2;
+
+function prefetchAround(direction = 1) {
+    const count = state.photos.length;
+    if (count < 2) return;
+
+    // Most urgent first: the photos ahead, then the ones just passed
+    const offsets = [];
+    for (let i = 1; i <= PREFETCH_AHEAD; i++) offsets.push(i * direction);
+    for (let i = 1; i <= PREFETCH_BEHIND; i++) offsets.push(-i * direction);
+
+    const paths = [];
+    offsets.forEach(offset => {
+        const photo = state.photos[((state.currentCarouselIndex + offset) % count + count) % count];
+        if (photo.type !== 'video' && !paths.includes(photo.display_path)) {
+            paths.push(photo.display_path);
+        }
+    });
+
+    // The browser also downloads the very next photo
+    const next = state.photos[((state.currentCarouselIndex + direction) % count + count) % count];
+    if (next.type !== 'video') {
+        const preloadImg = new Image();
+        preloadImg.src = carouselImageUrl(next);
+    }
+
+    // Debounced: holding an arrow key only announces where the user stops
+    clearTimeout(state.prefetchTimer);
+    state.prefetchTimer = setTimeout(() => {
+        fetch('/api/prefetch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ folder: state.currentPath, paths, ...carouselViewport() })
+        }).catch(error => console.error('Error requesting prefetch:', error));
+    }, 150);
 }
 
 function navigateCarousel(direction) {
@@ -822,7 +1303,7 @@ function navigateCarousel(direction) {
     }
 
     updateCarousel();
-    preloadNextImage();
+    prefetchAround(direction);
 }
 
 // Marking Functions
@@ -1140,7 +1621,17 @@ function toggleView() {
     }
 }
 
+// Stop the carousel video and drop its connection (an empty src keeps it open)
+function stopVideo() {
+    const video = document.getElementById('carousel-video');
+    video.pause();
+    video.removeAttribute('src');
+    video.load();
+}
+
 function closeCarousel() {
+    exitZoom();
+    stopVideo();
     state.currentView = 'grid';
     document.getElementById('carousel-view').classList.remove('active');
     document.getElementById('revisor-panel').style.display = 'flex';
@@ -1164,6 +1655,10 @@ function handleKeyboard(e) {
             hideShortcutsModal();
             return;
         }
+        if (state.zoom) {
+            exitZoom();
+            return;
+        }
     }
 
     if (state.currentView !== 'carousel') return;
@@ -1181,6 +1676,16 @@ function handleKeyboard(e) {
             e.preventDefault();
             toggleMark(state.currentCarouselIndex);
             break;
+        case 'f':
+        case 'F':
+            e.preventDefault();
+            toggleFullResolution();
+            break;
+        case 'z':
+        case 'Z':
+            e.preventDefault();
+            toggleZoom();
+            break;
         case 'g':
         case 'G':
         case 'Escape':
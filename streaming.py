@@ -0,0 +1,181 @@
+"""
+Byte-range streaming of video files (RFC 9110 ranges)
+
+Shared by the Flask route and the ASGI server (asgi.py). A seek in the
+carousel player becomes a Range request that is served straight from the
+asked offset. A single range is a StreamFile, which limits reads to the
+range and exposes fileno(), so gunicorn can sendfile() it. Several
+ranges become a multipart/byteranges body.
+
+Streams are bounded in two ways so long playbacks do not pin file
+descriptors in every worker: an open-ended range ("bytes=0-", what
+browsers send) is answered with at most video_range_max_mb and the player
+asks for the next piece, and each client may only have a few streams open
+at once across all workers (flock()ed slot files, released with the file).
+"""
+
+import email.utils
+import fcntl
+import hashlib
+import os
+
+# More ranges than this in one request are ignored (whole file sent)
+MAX_RANGES = 16
+
+
+def parse_ranges(header, size):
+    """Byte ranges [(start, end), ...] a Range header asks for, sorted and merged
+
+    Returns None when the header must be ignored (not bytes, malformed or
+    too many ranges) and [] when no range overlaps the file (416).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not dash or not (first or last):
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+            else:
+                # Suffix range: the last N bytes
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(header, etag, mtime):
+    """Whether an If-Range header (strong ETag or date) still names this file"""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"'):
+        return header == f'"{etag}"'
+    if header.startswith('W/'):
+        # Weak validators never match If-Range
+        return False
+    try:
+        return email.utils.parsedate_to_datetime(header).timestamp() == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def limit_range(start, end, max_bytes):
+    """Shorten a range to max_bytes (0 = no limit); the client asks for the rest"""
+    if max_bytes and end - start + 1 > max_bytes:
+        return start, start + max_bytes - 1
+    return start, end
+
+
+def multipart_layout(ranges, size, content_type, boundary):
+    """Part headers of a multipart/byteranges body: ([(header, start, end)], closing, length)"""
+    parts = [(f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+              f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode(), start, end)
+             for start, end in ranges]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(header) + end - start + 1 for header, start, end in parts) + len(closing)
+    return parts, closing, length
+
+
+def read_chunks(fd, start, end, chunk_size):
+    """Yield bytes start..end of a file descriptor (pread: no shared offset)"""
+    offset = start
+    while offset <= end:
+        chunk = os.pread(fd, min(chunk_size, end + 1 - offset), offset)
+        if not chunk:
+            # File truncated while streaming
+            return
+        offset += len(chunk)
+        yield chunk
+
+
+def iter_multipart(stream, parts, closing, chunk_size):
+    """Body of a multipart/byteranges response; closes stream at the end"""
+    try:
+        for header, start, end in parts:
+            yield header
+            yield from read_chunks(stream.fileno(), start, end, chunk_size)
+        yield closing
+    finally:
+        stream.close()
+
+
+def acquire_slot(lock_dir, client, limit):
+    """Take one of a client's limit concurrent stream slots
+
+    Returns the locked slot file (close it to release) or None when the
+    client already has limit streams open in any worker.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    name = hashlib.sha1(client.encode()).hexdigest()[:16]
+    for i in range(limit):
+        slot = open(os.path.join(lock_dir, f'{name}-{i}'), 'a')
+        try:
+            fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot
+        except BlockingIOError:
+            slot.close()
+    return None
+
+
+class StreamFile:
+    """A file read from start for length bytes, holding a stream slot until closed
+
+    Servers that sendfile() (gunicorn) use fileno(), the current offset and
+    the Content-Length; others call read(), which stops at the range end.
+    """
+
+    def __init__(self, path, slot=None):
+        self._file = open(path, 'rb')
+        self._slot = slot
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._remaining = self.size
+
+    def select(self, start, end):
+        """Restrict reads to bytes start..end"""
+        self._file.seek(start)
+        self._remaining = end - start + 1
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+        if self._slot:
+            self._slot.close()
+            self._slot = None
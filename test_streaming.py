@@ -0,0 +1,216 @@
+"""
+Tests of the /api/video byte-range handling (streaming.py)
+
+    python3 -m pytest test_streaming.py
+"""
+
+import email.utils
+import os
+
+import pytest
+
+import streaming
+
+SIZE = 1000
+
+
+@pytest.fixture
+def video(tmp_path):
+    """A 'video' whose bytes are their own offset (mod 256), easy to check"""
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(bytes(i % 256 for i in range(SIZE)))
+    return path
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=100-100', [(100, 100)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=500-', [(500, 999)]),
+    ('bytes=900-5000', [(900, 999)]),
+    ('Bytes = 0-9', [(0, 9)]),
+])
+def test_single_suffix_and_open_ended_ranges(header, expected):
+    assert streaming.parse_ranges(header, SIZE) == expected
+
+
+def test_overlapping_and_adjacent_ranges_merge():
+    assert streaming.parse_ranges('bytes=50-60,0-9,5-20,21-30', SIZE) == [(0, 30), (50, 60)]
+    assert streaming.parse_ranges('bytes=0-,-10', SIZE) == [(0, 999)]
+
+
+@pytest.mark.parametrize('header', [
+    'items=0-9', 'bytes=x-9', 'bytes=0-y', 'bytes=9-0', 'bytes=-', 'bytes=10', 'bytes=0-9,,20-29',
+])
+def test_malformed_headers_are_ignored(header):
+    assert streaming.parse_ranges(header, SIZE) is None
+
+
+def test_too_many_ranges_are_ignored():
+    ranges = [f'{i * 10}-{i * 10 + 1}' for i in range(streaming.MAX_RANGES + 1)]
+    assert streaming.parse_ranges('bytes=' + ','.join(ranges[:-1]), SIZE) is not None
+    assert streaming.parse_ranges('bytes=' + ','.join(ranges), SIZE) is None
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=2000-3000', 'bytes=-0', 'bytes=1000-1000,-0'])
+def test_unsatisfiable_ranges(header):
+    assert streaming.parse_ranges(header, SIZE) == []
+
+
+def test_unsatisfiable_ranges_are_skipped_next_to_satisfiable_ones():
+    assert streaming.parse_ranges('bytes=2000-,0-9', SIZE) == [(0, 9)]
+
+
+def test_if_range_with_etag():
+    assert streaming.if_range_matches(None, 'abc', 0)
+    assert streaming.if_range_matches('"abc"', 'abc', 0)
+    assert not streaming.if_range_matches('"old"', 'abc', 0)
+    # Weak validators never match
+    assert not streaming.if_range_matches('W/"abc"', 'abc', 0)
+
+
+def test_if_range_with_date():
+    mtime = 1_700_000_000.75
+    date = email.utils.formatdate(int(mtime), usegmt=True)
+    assert streaming.if_range_matches(date, 'abc', mtime)
+    assert not streaming.if_range_matches(email.utils.formatdate(mtime - 60, usegmt=True), 'abc', mtime)
+    assert not streaming.if_range_matches('not a date', 'abc', mtime)
+
+
+def test_limit_range():
+    assert streaming.limit_range(0, 999, 100) == (0, 99)
+    assert streaming.limit_range(950, 999, 100) == (950, 999)
+    assert streaming.limit_range(0, 999, 0) == (0, 999)
+
+
+def test_stream_file_reads_only_the_selected_range(video):
+    stream = streaming.StreamFile(video)
+    try:
+        assert stream.size == SIZE
+        stream.select(250, 260)
+        assert stream.tell() == 250
+        assert stream.read(4) + stream.read() == video.read_bytes()[250:261]
+        assert stream.read() == b''
+    finally:
+        stream.close()
+
+
+def test_multipart_length_matches_bytes_sent(video):
+    ranges = streaming.parse_ranges('bytes=0-9,500-520,-3', SIZE)
+    parts, closing, length = streaming.multipart_layout(ranges, SIZE, 'video/mp4', 'BOUNDARY')
+    stream = streaming.StreamFile(video)
+    # A chunk size that does not divide the ranges
+    body = b''.join(streaming.iter_multipart(stream, parts, closing, 7))
+
+    assert len(body) == length
+    data = video.read_bytes()
+    sections = body.split(b'\r\n--BOUNDARY')
+    assert sections[0] == b'' and sections[-1] == b'--\r\n'
+    for section, (start, end) in zip(sections[1:-1], ranges):
+        headers, _, payload = section.partition(b'\r\n\r\n')
+        assert f'Content-Range: bytes {start}-{end}/{SIZE}'.encode() in headers
+        assert payload == data[start:end + 1]
+    # iter_multipart closes the stream (and releases its slot) at the end
+    with pytest.raises(ValueError):
+        stream.fileno()
+
+
+def test_stream_slots_per_client(tmp_path):
+    first = streaming.acquire_slot(str(tmp_path), '10.0.0.1', 2)
+    second = streaming.acquire_slot(str(tmp_path), '10.0.0.1', 2)
+    assert first and second
+    assert streaming.acquire_slot(str(tmp_path), '10.0.0.1', 2) is None
+    # Other clients have their own slots
+    other = streaming.acquire_slot(str(tmp_path), '10.0.0.2', 2)
+    assert other
+    first.close()
+    third = streaming.acquire_slot(str(tmp_path), '10.0.0.1', 2)
+    assert third
+    for slot in (second, other, third):
+        slot.close()
+
+
+@pytest.fixture
+def client(tmp_path, video, monkeypatch):
+    """Flask test client allowed to read the video's folder"""
+    import app
+    import config
+
+    settings = dict(config.DEFAULT_CONFIG, mount_points=[str(tmp_path)], video_range_max_mb=0)
+    monkeypatch.setattr(app, 'load_config', lambda: settings)
+    monkeypatch.setattr(app, 'LOCK_DIR', str(tmp_path / 'locks'))
+    return app.app.test_client()
+
+
+def get_video(client, video, **headers):
+    return client.get('/api/video', query_string={'path': str(video)}, headers=headers)
+
+
+def test_route_answers_unsatisfiable_ranges_with_416(client, video):
+    response = get_video(client, video, Range='bytes=5000-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+def test_route_single_range(client, video):
+    response = get_video(client, video, Range='bytes=10-19')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 10-19/{SIZE}'
+    assert response.headers['Content-Length'] == '10'
+    assert response.get_data() == video.read_bytes()[10:20]
+
+
+def test_route_ignores_range_when_if_range_is_stale(client, video):
+    response = get_video(client, video, Range='bytes=10-19', **{'If-Range': '"old"'})
+    assert response.status_code == 200
+    assert response.get_data() == video.read_bytes()
+
+
+def test_route_multipart_content_length_matches_body(client, video):
+    response = get_video(client, video, Range='bytes=0-9,100-199,-5')
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    body = response.get_data()
+    assert int(response.headers['Content-Length']) == len(body)
+    assert body.count(b'Content-Range: bytes ') == 3
+
+
+def test_route_caps_open_ended_ranges(client, video, monkeypatch):
+    import app
+    monkeypatch.setitem(app.load_config(), 'video_range_max_mb', 1)
+    big = video.parent / 'big.mp4'
+    big.write_bytes(os.urandom(3 * 1024 * 1024))
+    response = get_video(client, big, Range='bytes=0-')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-{1024 * 1024 - 1}/{3 * 1024 * 1024}'
+    assert len(response.get_data()) == 1024 * 1024
+
+
+def test_route_caps_whole_file_requests(client, video, monkeypatch):
+    import app
+    monkeypatch.setitem(app.load_config(), 'video_range_max_mb', 1)
+    big = video.parent / 'big.mp4'
+    big.write_bytes(os.urandom(3 * 1024 * 1024))
+    response = get_video(client, big)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-{1024 * 1024 - 1}/{3 * 1024 * 1024}'
+    assert len(response.get_data()) == 1024 * 1024
+    # Files under the cap still go out whole
+    assert get_video(client, video).status_code == 200
+
+
+def test_route_limits_stalled_sends(client, video):
+    import app
+
+    class Socket:
+        timeout = None
+
+        def settimeout(self, timeout):
+            self.timeout = timeout
+
+    sock = Socket()
+    response = client.get('/api/video', query_string={'path': str(video)},
+                          environ_overrides={'gunicorn.socket': sock})
+    assert response.status_code == 200
+    assert sock.timeout == app.VIDEO_STALL_SECONDS
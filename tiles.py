@@ -0,0 +1,85 @@
+"""
+Deep-zoom tile pyramid (DZI layout)
+
+The top level is the image at full resolution and every level below it
+halves the previous one, down to 1x1 px at level 0. Tiles are TILE_SIZE
+squares (smaller along the right and bottom edges) without overlap, so a
+viewer only fetches the tiles covering its viewport at the current level.
+
+A tile is rendered on its own by resampling only the source pixels under
+it (cut_tile), so the first tile of a level does not wait for the whole
+level; cut_tiles renders a whole level from one decode for callers that
+fill the rest of it in the background.
+"""
+
+import math
+
+from PIL import Image
+
+# Edge of a tile in px
+TILE_SIZE = 512
+
+
+def top_level(width, height):
+    """Index of the full-resolution level of a width x height image"""
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def level_size(width, height, level):
+    """Size of a pyramid level (each level below the top halves the image)"""
+    scale = 2 ** (top_level(width, height) - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def tile_counts(size):
+    """(columns, rows) of tiles covering an image of the given size"""
+    return math.ceil(size[0] / TILE_SIZE), math.ceil(size[1] / TILE_SIZE)
+
+
+def pyramid_info(width, height):
+    """Descriptor of a pyramid, the JSON counterpart of a .dzi file"""
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': TILE_SIZE,
+        'overlap': 0,
+        'max_level': top_level(width, height),
+        'format': 'jpg'
+    }
+
+
+def tile_box(size, x, y):
+    """Pixel box (left, top, right, bottom) of tile (x, y) in a level of the given size"""
+    return (x * TILE_SIZE, y * TILE_SIZE,
+            min((x + 1) * TILE_SIZE, size[0]), min((y + 1) * TILE_SIZE, size[1]))
+
+
+def cut_tile(img, size, x, y):
+    """Tile (x, y) of an oriented image scaled to a level size
+
+    Only the source region under the tile (plus the filter's reach around
+    it) is resampled, giving the same pixels as the tile from cut_tiles.
+    """
+    box = tile_box(size, x, y)
+    if img.size == size:
+        tile = img.crop(box)
+    else:
+        scale_x, scale_y = img.width / size[0], img.height / size[1]
+        tile = img.resize((box[2] - box[0], box[3] - box[1]), Image.Resampling.LANCZOS,
+                          box=(box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y))
+    if tile.mode not in ('RGB', 'L'):
+        tile = tile.convert('RGB')
+    return tile
+
+
+def cut_tiles(img, size):
+    """Resize an oriented image to a level size and yield ((x, y), tile)"""
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    columns, rows = tile_counts(size)
+    for y in range(rows):
+        for x in range(columns):
+            yield (x, y), img.crop(tile_box(size, x, y))